@@ -37,13 +37,16 @@ class AIR780EU(LTE_Device):
     use LTE and might? fall back to GSM, which I could personally not reproduce.
     So for the time being, we are going to assume that it is always in LTE mode.
     """
-    def __init__(self, path: str, baudrate: int = 115200):
-        super().__init__(path, baudrate)
+    # Sleeps once the UART is idle and wakes on incoming data, no DTR needed.
+    SLEEP_MODE = 2
+
+    def __init__(self, path: str, baudrate: int = 115200, **kwargs):
+        super().__init__(path, baudrate, **kwargs)
 
     def get_cell_info(self) -> CellInfo:
         """Querying cell info can take some time."""
         self.write("AT+CCED=0,1")
-        response = self.read(30)
+        response = self.read()
         value = response[1].split(":")[2].strip().replace("\"", "")
         fields = list(map(int, value.split(",")))
 
@@ -77,6 +80,9 @@ class AIR780EU(LTE_Device):
 
         return sorted(fdd_bands + tdd_bands)
 
+    def get_supported_bands(self) -> List[int]:
+        return sorted(list(FDD_BAND_MAP.values()) + list(TDD_BAND_MAP.values()))
+
     def get_active_band(self) -> int:
         self.write("AT*BANDIND?")
         response = self.read()
@@ -1,10 +1,31 @@
-from serial import Serial
+import re
+import threading
 import time
 import typing
 
+from .AT_Error import AT_Error, Timeout_Error, parse_error
+from .Capture import Capture_Serial
 from .Status import Status
+from .Timeout_Policy import Timeout_Policy
+from .Transport import default_pool, open_transport
 from .setup_logger import logger
 
+# Final result code, possibly followed by URCs that arrived right after it.
+FINAL_RESULT = re.compile(
+    r"\r\n(?:OK|ERROR|\+CM[ES] ERROR:[^\r\n]*)\r\n((?:\r\n\+[^\r\n]*\r\n)*)$"
+)
+
+# Commands configuring URCs, see AT_Device.urc_settings.
+URC_SETTINGS = (
+    "AT+CMEE=",
+    "AT+CNMI=",
+    "AT+CREG=",
+    "AT+CGREG=",
+    "AT+CEREG=",
+    "AT+CLIP=",
+    "AT+CGNSSINFO=",
+)
+
 
 class AT_Device:
     """
@@ -12,10 +33,63 @@ class AT_Device:
     For higher level GSM features, use GSM_Device.
     """
 
-    def __init__(self, path: str, baudrate: int = 9600):
-        """ Open AT device. Nothing else. """
+    def __init__(self, path: str, baudrate: int = 9600,
+                 timeout_policy: Timeout_Policy = None, transport=None,
+                 capture: str = None, reuse_connection: bool = False):
+        """
+        Open AT device. Nothing else.
+
+        path is a device path or any pyserial URL, e.g. socket://host:port
+        or rfc2217://host:port for modems behind a serial server. Network
+        connections reconnect with backoff. With reuse_connection, the
+        connection stays open when the device is deleted and is reused by
+        the next device opened for the same path.
+
+        Read timeouts are taken from timeout_policy, which learns them from
+        observed latency. Pass a shared policy to persist it across devices.
+
+        A transport with the pyserial interface, e.g. Replay_Serial, can be
+        passed instead of opening path. With capture set, all traffic is
+        appended to that capture file.
+        """
+        self.path = path
+        self.timeout_policy = timeout_policy or Timeout_Policy()
+        self.last_command = ""
+        self.last_write_time = 0.0
+        self.awaiting_response = False
+        # Error of the last response, None if it succeeded. See AT_Error.
+        self.last_error: AT_Error = None
+        # Health counters, reset by every complete response. See Watchdog.
+        self.consecutive_timeouts = 0
+        self.consecutive_decode_errors = 0
+
+        # Last value of commands that configure URCs, by command key, so
+        # they can be restored after a reboot.
+        self.urc_settings: typing.Dict[str, str] = {}
+
+        # Held for whole command transactions when a device is shared
+        # between threads, see Command_Executor.
+        self.lock = threading.RLock()
+
+        # Callbacks for unsolicited result codes by line prefix.
+        self.urc_handlers: typing.Dict[str, typing.List[typing.Callable]] = {}
+        self.urc_buffer = ""
+        # Prefixes of lines the last command reports after its final
+        # result, see expect_urc().
+        self.expected_urcs: typing.Set[str] = set()
+        # Bytes read past the end of the last read_raw()/read_raw_until().
+        self.raw_buffer = b""
+
         self.serial = None
-        self.serial = Serial(path, timeout=0.5, baudrate=baudrate)
+        self.reuse_connection = reuse_connection and transport is None
+        if transport is not None:
+            self.serial = transport
+        elif self.reuse_connection:
+            self.serial = default_pool.acquire(path, baudrate)
+        else:
+            self.serial = open_transport(path, baudrate)
+        if capture:
+            self.serial = Capture_Serial(self.serial, capture)
         if self.serial:
             logger.debug(f"AT serial device opened at {path}")
 
@@ -25,7 +99,9 @@ class AT_Device:
 
     def __del__(self):
         """ Close AT device. """
-        if self.serial:
+        if getattr(self, "reuse_connection", False):
+            default_pool.release(self.path)
+        elif getattr(self, "serial", None):
             self.serial.close()
 
     def write(self, cmd: str, endline: bool = True) -> str:
@@ -33,13 +109,26 @@ class AT_Device:
         Write a single line to the serial port.
 
         NOTE: Input buffer is cleared before writing in order to get rid of
-              garbage and pending URCs.
+              garbage and pending URCs. URCs with a registered handler are
+              dispatched first.
         """
         logger.debug(f"WRITE: {cmd}")
+        if endline and cmd.upper().startswith("AT"):
+            self.last_command = Timeout_Policy.command_key(cmd)
+            self.last_write_time = time.monotonic()
+            self.awaiting_response = True
+            if self.last_command in URC_SETTINGS:
+                self.urc_settings[self.last_command] = cmd
+
         if endline:
             cmd += "\r\n"
         encoded = cmd.encode()
 
+        if self.urc_handlers:
+            self.poll_urcs()
+        self.urc_buffer = ""
+        self.expected_urcs.clear()
+        self.raw_buffer = b""
         self.serial.reset_input_buffer()
         self.serial.write(encoded)
 
@@ -48,9 +137,68 @@ class AT_Device:
     def write_ctrlz(self) -> str:
         """ Write the terminating CTRL-Z to end a prompt. """
         logger.debug("WRITE: Ctrl-Z")
+        self.last_command += "^Z"
+        self.last_write_time = time.monotonic()
+        self.awaiting_response = True
         self.serial.write(bytes([26]))
         return Status.OK
 
+    def write_raw(self, data: bytes) -> str:
+        """ Write raw bytes, e.g. a binary payload after a prompt. """
+        logger.debug(f"WRITE: {len(data)} bytes")
+        self.serial.write(data)
+        return Status.OK
+
+    def read_raw_until(self, terminator: bytes, timeout: float = None) -> bytes:
+        """
+        Read raw bytes up to and including terminator, without decoding.
+        Returns what was read so far if the timeout passes first.
+        """
+        if timeout is None:
+            timeout = self.timeout_policy.get(self.last_command)
+
+        data = self.raw_buffer
+        start_time = time.monotonic()
+        while terminator not in data:
+            if time.monotonic() - start_time > timeout:
+                self.raw_buffer = b""
+                self.last_error = Timeout_Error(f"Timeout after {timeout}s")
+                return data
+
+            avail = self.serial.in_waiting
+            if avail > 0:
+                data += self.serial.read(avail)
+            else:
+                time.sleep(0.001)
+
+        end = data.index(terminator) + len(terminator)
+        self.raw_buffer = data[end:]
+        return data[:end]
+
+    def read_raw(self, size: int, timeout: float = None) -> bytes:
+        """
+        Read exactly size raw bytes, e.g. a binary payload, without decoding.
+        Returns fewer bytes if the timeout passes first.
+        """
+        if timeout is None:
+            timeout = self.timeout_policy.get(self.last_command)
+
+        data = bytearray(self.raw_buffer)
+        start_time = time.monotonic()
+        while len(data) < size:
+            if time.monotonic() - start_time > timeout:
+                self.last_error = Timeout_Error(f"Timeout after {timeout}s")
+                break
+
+            avail = self.serial.in_waiting
+            if avail > 0:
+                data += self.serial.read(avail)
+            else:
+                time.sleep(0.001)
+
+        self.raw_buffer = bytes(data[size:])
+        return bytes(data[:size])
+
     def has_terminator(response, stopterm: str = "") -> bool:
         """ Return True if response is final. """
         # If the string ends with one of these terms, then we stop reading.
@@ -59,6 +207,8 @@ class AT_Device:
             "\r\nERROR\r\n",
             "> "
         ]
+        # Extended errors (+CME ERROR/+CMS ERROR) are matched by FINAL_RESULT.
+        # Final results followed by URCs are left to AT_Device.trailing_urcs().
 
         # We can stop reading if either an endterm is detected or
         # the stopterm is inside the string which causes immediate halt.
@@ -67,8 +217,28 @@ class AT_Device:
             if response.endswith(s):
                 can_terminate = True
                 break
+        final = FINAL_RESULT.search(response)
+        if final and not final.group(1):
+            can_terminate = True
         return can_terminate
 
+    def trailing_urcs(self, response: str) -> typing.Optional[re.Match]:
+        """
+        Match the final result of response if it is followed by lines, all of
+        which are URCs with a handler or expected by expect_urc(). Other
+        lines may still be part of the response, like the next entry of a
+        message list after a message reading "OK".
+        """
+        final = FINAL_RESULT.search(response)
+        if final is None or not final.group(1):
+            return None
+
+        prefixes = tuple(self.urc_handlers) + tuple(self.expected_urcs)
+        lines = [line for line in final.group(1).split("\r\n") if line]
+        if prefixes and all(line.startswith(prefixes) for line in lines):
+            return final
+        return None
+
     def tokenize_response(response: str) -> typing.List[str]:
         """ Chop a response in pieces for parsing. """
         # First split by newline.
@@ -94,11 +264,20 @@ class AT_Device:
 
         return final_table
 
-    def read(self, timeout: int = 10, stopterm: str = "") -> typing.List[str]:
+    def read(self, timeout: float = None, stopterm: str = "") -> typing.List[str]:
         """
         Read a single whole response from an AT command.
         Returns a list of tokens for parsing.
+
+        Without an explicit timeout, the timeout policy decides based on the
+        latency previously observed for the last written command.
         """
+        # Only the first read after a command measures its latency.
+        measure = self.awaiting_response and stopterm == ""
+        self.awaiting_response = False
+        if timeout is None:
+            timeout = self.timeout_policy.get(self.last_command)
+
         resp = ""
         start_time = time.time()
         delay = 0.01
@@ -111,18 +290,154 @@ class AT_Device:
                     resp += self.serial.read(avail).decode("utf-8")
                 except:
                     logger.debug(f"READ: {resp}")
+                    self.last_error = AT_Error("Response is not valid UTF-8", response=[resp])
+                    self.consecutive_decode_errors += 1
                     return [resp, Status.ERROR]
 
-                if AT_Device.has_terminator(resp, stopterm):
+                final = self.trailing_urcs(resp)
+                if final or AT_Device.has_terminator(resp, stopterm):
                     logger.debug(f"READ: {resp}")
+                    if measure:
+                        latency = time.monotonic() - self.last_write_time
+                        self.timeout_policy.record(self.last_command, latency)
+                    # Keep URCs following the final result for wait_urc().
+                    if final:
+                        self.urc_buffer = final.group(1) + self.urc_buffer
+                        resp = resp[:final.start(1)]
+                    if self.urc_handlers:
+                        resp = self.dispatch_urcs(resp)
                     table = AT_Device.tokenize_response(resp)
+                    self.last_error = parse_error(table[-1], table) if table else None
+                    self.consecutive_timeouts = 0
+                    self.consecutive_decode_errors = 0
                     return table
 
             if time.time() - start_time > timeout:
+                if measure:
+                    self.timeout_policy.record_timeout(self.last_command, timeout)
+                self.last_error = Timeout_Error(f"Timeout after {timeout}s", [resp])
+                self.consecutive_timeouts += 1
                 return [resp, Status.TIMEOUT]
 
             time.sleep(delay)
 
+    def command(self, cmd: str, timeout: float = None, retries: int = 0,
+                retry_delay: float = 1) -> typing.List[str]:
+        """
+        Write a command and return its tokenized response.
+
+        Raises AT_Error, or its subclasses CME_Error, CMS_Error and
+        Timeout_Error, if the command fails. Errors marked transient are
+        retried up to retries times, permanent ones are raised immediately.
+        """
+        attempt = 0
+        while True:
+            self.write(cmd)
+            response = self.read(timeout)
+            error = self.last_error
+            if error is None:
+                return response
+            if not error.transient or attempt >= retries:
+                raise error
+
+            attempt += 1
+            logger.debug(f"{error}: Retrying {cmd} ({attempt}/{retries})")
+            time.sleep(retry_delay)
+
+    def add_urc_handler(self, prefix: str, callback: typing.Callable[[str], None]):
+        """
+        Call callback with every line starting with prefix, e.g. "+CMTI:".
+        Such lines are removed from command responses, unless the last
+        command was the one producing them. Callbacks run on the reading
+        thread and must not issue commands themselves.
+        """
+        self.urc_handlers.setdefault(prefix, []).append(callback)
+
+    def remove_urc_handler(self, prefix: str, callback: typing.Callable[[str], None]):
+        handlers = self.urc_handlers.get(prefix, [])
+        if callback in handlers:
+            handlers.remove(callback)
+        if not handlers:
+            self.urc_handlers.pop(prefix, None)
+
+    def handle_urc(self, line: str, in_response: bool = False) -> bool:
+        """ Dispatch a line to its URC handlers. Returns True if handled. """
+        for prefix, handlers in list(self.urc_handlers.items()):
+            if not line.startswith(prefix):
+                continue
+            # The response of a query looks just like its URC.
+            if in_response and prefix.rstrip(":") in self.last_command:
+                return False
+            for callback in list(handlers):
+                callback(line)
+            return True
+        return False
+
+    def dispatch_urcs(self, response: str) -> str:
+        """ Dispatch URC lines in a response and return the remainder. """
+        lines = response.split("\r\n")
+        remainder = [line for line in lines if not self.handle_urc(line.replace("\r", ""), True)]
+        return "\r\n".join(remainder)
+
+    def read_lines(self) -> typing.List[str]:
+        """ Read complete non-empty lines, keeping a partial line buffered. """
+        avail = self.serial.in_waiting
+        if avail > 0:
+            self.urc_buffer += self.serial.read(avail).decode("utf-8", errors="replace")
+
+        *lines, self.urc_buffer = self.urc_buffer.split("\r\n")
+        lines = [line.replace("\r", "") for line in lines]
+        return [line for line in lines if line != ""]
+
+    def poll_urcs(self) -> int:
+        """
+        Dispatch URCs that arrived while no command was running.
+        Returns the number of lines handled.
+        """
+        handled = 0
+        with self.lock:
+            for line in self.read_lines():
+                if self.handle_urc(line):
+                    handled += 1
+                else:
+                    logger.debug(f"Dropping unhandled line: {line}")
+        return handled
+
+    def expect_urc(self, prefix: str):
+        """
+        Announce that the command just written reports a line starting with
+        prefix after its final result, to be fetched with wait_urc(). Call
+        it between write() and read().
+        """
+        self.expected_urcs.add(prefix)
+
+    def wait_urc(self, prefix: str, timeout: float = None) -> str:
+        """
+        Wait for a line starting with prefix, e.g. a final result reported
+        after OK. Other URCs are dispatched meanwhile. Returns the line or
+        None on timeout.
+        """
+        if timeout is None:
+            timeout = self.timeout_policy.get(self.last_command)
+
+        start_time = time.monotonic()
+        with self.lock:
+            while True:
+                lines = self.read_lines()
+                for i, line in enumerate(lines):
+                    if line.startswith(prefix):
+                        logger.debug(f"READ: {line}")
+                        rest = "".join(rest + "\r\n" for rest in lines[i + 1:])
+                        self.urc_buffer = rest + self.urc_buffer
+                        return line
+                    if not self.handle_urc(line):
+                        logger.debug(f"Dropping unhandled line: {line}")
+
+                if time.monotonic() - start_time > timeout:
+                    return None
+
+                time.sleep(0.01)
+
     def read_status(self, msg: str = "") -> str:
         """ Returns status of latest response. """
         status = self.read()[-1]
@@ -140,7 +455,7 @@ class AT_Device:
         # A broken serial port will not reply.
         while True:
             self.write("AT")
-            status = self.read(timeout=5)[-1]
+            status = self.read()[-1]
             if status == Status.OK:
                 logger.debug("Succesful")
                 return status
@@ -148,6 +463,7 @@ class AT_Device:
                 logger.debug("-> Retrying")
             else:
                 logger.debug("Failure")
+                return status
 
     def reset_state(self) -> str:
         """ Ensures the state of the AT device is on par for a new environment. """
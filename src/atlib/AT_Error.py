@@ -0,0 +1,106 @@
+import typing
+
+# Equipment errors of 3GPP TS 27.007 as reported by AT+CMEE=2.
+CME_MESSAGES = {
+    0: "phone failure",
+    3: "operation not allowed",
+    4: "operation not supported",
+    10: "SIM not inserted",
+    11: "SIM PIN required",
+    12: "SIM PUK required",
+    13: "SIM failure",
+    14: "SIM busy",
+    15: "SIM wrong",
+    16: "incorrect password",
+    20: "memory full",
+    21: "invalid index",
+    22: "not found",
+    30: "no network service",
+    31: "network timeout",
+    32: "network not allowed - emergency calls only",
+    100: "unknown",
+}
+
+# Message service errors of 3GPP TS 27.005.
+CMS_MESSAGES = {
+    300: "ME failure",
+    302: "operation not allowed",
+    303: "operation not supported",
+    304: "invalid PDU mode parameter",
+    305: "invalid text mode parameter",
+    310: "SIM not inserted",
+    311: "SIM PIN required",
+    313: "SIM failure",
+    314: "SIM busy",
+    320: "memory failure",
+    321: "invalid memory index",
+    322: "memory full",
+    330: "SMSC address unknown",
+    331: "no network service",
+    332: "network timeout",
+    500: "unknown error",
+}
+
+# Errors worth retrying: busy SIM or modem, missing network, congestion.
+TRANSIENT_CME = {14, 30, 31, 32, 100, 515}
+TRANSIENT_CMS = {38, 41, 42, 47, 314, 331, 332, 500}
+
+
+class AT_Error(Exception):
+    """
+    Final error result of an AT command.
+
+    transient tells whether retrying the same command later may succeed.
+    """
+
+    def __init__(self, message: str, code: int = None, transient: bool = False,
+                 response: typing.List[str] = None):
+        super().__init__(message)
+        self.code = code
+        self.transient = transient
+        self.response = response
+
+
+class CME_Error(AT_Error):
+    """ Equipment error, +CME ERROR. """
+
+
+class CMS_Error(AT_Error):
+    """ Message service error, +CMS ERROR. """
+
+
+class Timeout_Error(AT_Error):
+    """ No final result within the timeout. """
+
+    def __init__(self, message: str = "Timeout", response: typing.List[str] = None):
+        super().__init__(message, transient=True, response=response)
+
+
+def parse_error(line: str, response: typing.List[str] = None) -> AT_Error:
+    """
+    Convert a final result line to an error, None if it is no error.
+    Handles numeric and verbose +CME/+CMS ERROR as well as bare ERROR.
+    """
+    line = line.strip()
+    if line == "ERROR":
+        return AT_Error("ERROR", response=response)
+
+    for prefix, cls, messages, transient_codes in (
+        ("+CME ERROR:", CME_Error, CME_MESSAGES, TRANSIENT_CME),
+        ("+CMS ERROR:", CMS_Error, CMS_MESSAGES, TRANSIENT_CMS),
+    ):
+        if not line.startswith(prefix):
+            continue
+
+        value = line[len(prefix):].strip()
+        if value.isdigit():
+            code = int(value)
+            message = messages.get(code, value)
+        else:
+            message = value
+            codes = [c for c, m in messages.items() if m.lower() == value.lower()]
+            code = codes[0] if codes else None
+
+        return cls(f"{prefix} {message}", code, code in transient_codes, response)
+
+    return None
@@ -0,0 +1,175 @@
+import json
+import os
+import time
+import typing
+
+from .GSM_Device import REGISTERED
+from .setup_logger import logger
+
+# AT+CESQ reports this value if RSRP or RSRQ is not known.
+UNKNOWN = 255
+
+
+def rsrp_to_dbm(value: int) -> int:
+    """ Convert an AT+CESQ RSRP index to dBm. """
+    return value - 141
+
+
+def rsrq_to_db(value: int) -> float:
+    """ Convert an AT+CESQ RSRQ index to dB. """
+    return value * 0.5 - 20
+
+
+class Band_Survey:
+    """
+    Picks the LTE bands with the best signal for the current site.
+
+    Works with devices providing get_supported_bands(), get_allowed_bands(),
+    set_allowed_bands() and get_active_band(), currently AIR780EU and
+    SIM7600GH. Each candidate band is locked in turn, and once the modem
+    serves on it, RSRP and RSRQ are sampled via get_signal_quality() and
+    scored as rsrp_dbm + rsrq_weight * rsrq_db. Results are cached per
+    serving cell, so later boots apply the cached choice without a survey.
+    """
+
+    def __init__(
+        self,
+        device,
+        cache_path: str = None,
+        register_timeout: float = 60,
+        samples: int = 3,
+        sample_interval: float = 1,
+        rsrq_weight: float = 2,
+        max_age: float = None
+    ):
+        """ max_age in seconds after which cached results are surveyed again. """
+        self.device = device
+        self.cache_path = cache_path
+        self.register_timeout = register_timeout
+        self.samples = samples
+        self.sample_interval = sample_interval
+        self.rsrq_weight = rsrq_weight
+        self.max_age = max_age
+
+        self.cache: typing.Dict[str, dict] = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+
+    def get_site_key(self) -> str:
+        """
+        Identify the serving cell, falling back to the operator. The
+        registration report mode (AT+CREG) is left as it is.
+        """
+        if hasattr(self.device, "get_cell_info"):
+            info = self.device.get_cell_info()
+            return f"{info.mcc}-{info.mnc}-{info.cell_id}"
+        if hasattr(self.device, "get_serving_cell"):
+            cell = self.device.get_serving_cell()
+            if cell is not None:
+                return f"{cell.mcc}-{cell.mnc}-{cell.cell_id}"
+
+        operator = self.device.get_current_operator()
+        try:
+            # Only includes the cell if location reporting is enabled.
+            _, _, lac, cell_id = self.device.get_cell_location()
+            return f"{operator}-{lac}-{cell_id}"
+        except (IndexError, ValueError):
+            return f"{operator}"
+
+    def wait_for_bands(self, bands: typing.List[int]) -> bool:
+        """
+        Wait until the device is registered on LTE on one of bands. After
+        changing the allowed bands, the previous registration is reported
+        until the modem has moved, so the active band is checked as well.
+        """
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < self.register_timeout:
+            try:
+                _, stat = self.device.get_eps_registration()
+                if stat in REGISTERED and self.device.get_active_band() in bands:
+                    return True
+            except (IndexError, ValueError):
+                pass
+            time.sleep(1)
+        return False
+
+    def measure(self) -> float:
+        """ Average score of the current band, None if not measurable. """
+        scores = []
+        for i in range(self.samples):
+            if i > 0:
+                time.sleep(self.sample_interval)
+            quality = self.device.get_signal_quality()
+            if quality.rsrp == UNKNOWN or quality.rsrq == UNKNOWN:
+                continue
+            scores.append(rsrp_to_dbm(quality.rsrp) + self.rsrq_weight * rsrq_to_db(quality.rsrq))
+
+        if not scores:
+            return None
+        return sum(scores) / len(scores)
+
+    def survey(self, candidates: typing.List[int]) -> typing.Dict[int, float]:
+        """
+        Lock each candidate band and score it. Bands without registration
+        are left out. The allowed bands are not restored.
+        """
+        scores = {}
+        for band in candidates:
+            logger.debug(f"Surveying band {band}")
+            self.device.set_allowed_bands([band])
+            if not self.wait_for_bands([band]):
+                logger.debug(f"Band {band}: no registration")
+                continue
+
+            score = self.measure()
+            logger.debug(f"Band {band}: score {score}")
+            if score is not None:
+                scores[band] = score
+        return scores
+
+    def optimize(self, candidates: typing.List[int] = None, keep: int = 1,
+                 use_cache: bool = True) -> typing.List[int]:
+        """
+        Allow only the keep best scoring bands and return them.
+
+        Candidates default to all bands the device supports, so a new site
+        is surveyed in full even if an earlier optimize() narrowed the
+        allowed bands. If no band could be scored, the previously allowed
+        bands are restored. Results are cached under the cell served once
+        the chosen bands apply.
+        """
+        allowed = self.device.get_allowed_bands()
+        if candidates is None:
+            candidates = self.device.get_supported_bands()
+
+        key = self.get_site_key()
+        cached = self.cache.get(key)
+        if use_cache and cached:
+            fresh = self.max_age is None or time.time() - cached["time"] < self.max_age
+            if fresh and set(cached["bands"]) <= set(candidates):
+                logger.debug(f"Using cached bands {cached['bands']} for {key}")
+                self.device.set_allowed_bands(cached["bands"])
+                return cached["bands"]
+
+        scores = self.survey(candidates)
+        if not scores:
+            logger.debug("No band could be scored, restoring allowed bands")
+            self.device.set_allowed_bands(allowed)
+            return allowed
+
+        best = sorted(scores, key=scores.get, reverse=True)[:keep]
+        self.device.set_allowed_bands(best)
+        if self.wait_for_bands(best):
+            key = self.get_site_key()
+
+        self.cache[key] = {
+            "bands": best,
+            "scores": {str(band): score for band, score in scores.items()},
+            "time": time.time(),
+        }
+        if self.cache_path:
+            with open(self.cache_path, "w") as f:
+                json.dump(self.cache, f)
+
+        return best
@@ -0,0 +1,157 @@
+from collections import deque
+import struct
+import time
+import typing
+
+# A capture file starts with MAGIC, followed by records of a RECORD header
+# and the payload. The header holds the direction (b"W" for bytes written to
+# the modem, b"R" for bytes read from it), the monotonic time in seconds since
+# the capture was started and the payload length.
+MAGIC = b"ATCAP\x01"
+RECORD = struct.Struct("<cdI")
+
+WRITE = b"W"
+READ = b"R"
+
+
+def read_capture(path: str) -> typing.Iterator[typing.Tuple[bytes, float, bytes]]:
+    """ Yield (direction, timestamp, data) records of a capture file. """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an AT capture file")
+
+        # A capture appended to across sessions holds several headers.
+        while True:
+            header = f.read(RECORD.size)
+            if header.startswith(MAGIC):
+                f.seek(len(MAGIC) - len(header), 1)
+                continue
+            if len(header) < RECORD.size:
+                return
+            direction, timestamp, length = RECORD.unpack(header)
+            yield direction, timestamp, f.read(length)
+
+
+class Capture_Serial:
+    """
+    Wraps a serial port and appends every byte written and read to a
+    capture file. Everything else is passed through to the port.
+    """
+
+    def __init__(self, serial, path: str):
+        self.serial = serial
+        self.log = open(path, "ab")
+        self.log.write(MAGIC)
+        self.start_time = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+    def record(self, direction: bytes, data: bytes):
+        timestamp = time.monotonic() - self.start_time
+        self.log.write(RECORD.pack(direction, timestamp, len(data)))
+        self.log.write(data)
+        self.log.flush()
+
+    @property
+    def dtr(self) -> bool:
+        return self.serial.dtr
+
+    @dtr.setter
+    def dtr(self, active: bool):
+        self.serial.dtr = active
+
+    def write(self, data: bytes) -> int:
+        self.record(WRITE, bytes(data))
+        return self.serial.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.serial.read(size)
+        if data:
+            self.record(READ, data)
+        return data
+
+    def close(self):
+        self.serial.close()
+        self.log.close()
+
+
+class Replay_Serial:
+    """
+    Serial port replaying a capture file, usable as transport of AT_Device.
+
+    Data read in the capture becomes available once as many writes happened
+    as in the capture before it. In realtime mode it additionally waits for
+    the recorded delay after the preceding write, scaled by speed. Otherwise
+    the replay runs as fast as the reader polls.
+
+    With strict enabled, a write that differs from the capture raises
+    ValueError, which turns a capture into a regression test.
+    """
+
+    def __init__(self, path: str, realtime: bool = False, speed: float = 1.0,
+                 strict: bool = False):
+        self.realtime = realtime
+        self.speed = speed
+        self.strict = strict
+        self.is_open = True
+
+        self.writes: typing.List[bytes] = []
+        # Pending reads as (writes before, delay after last write, data).
+        self.pending = deque()
+        last_write = 0.0
+        for direction, timestamp, data in read_capture(path):
+            if direction == WRITE:
+                self.writes.append(data)
+                last_write = timestamp
+            else:
+                self.pending.append((len(self.writes), timestamp - last_write, data))
+
+        self.writes_done = 0
+        self.last_write_time = time.monotonic()
+        self.buffer = b""
+
+    def release(self):
+        """ Move capture data that is due into the input buffer. """
+        now = time.monotonic()
+        while self.pending:
+            writes_before, delay, data = self.pending[0]
+            if self.writes_done < writes_before:
+                return
+            if self.realtime and now - self.last_write_time < delay / self.speed:
+                return
+            self.pending.popleft()
+            self.buffer += data
+
+    @property
+    def in_waiting(self) -> int:
+        self.release()
+        return len(self.buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        self.release()
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        if self.strict:
+            expected = None
+            if self.writes_done < len(self.writes):
+                expected = self.writes[self.writes_done]
+            if data != expected:
+                raise ValueError(f"Replay diverged: wrote {data!r}, capture has {expected!r}")
+
+        self.writes_done += 1
+        self.last_write_time = time.monotonic()
+        return len(data)
+
+    def reset_input_buffer(self):
+        # Everything captured before the next write would have been discarded.
+        while self.pending and self.pending[0][0] <= self.writes_done:
+            self.pending.popleft()
+        self.buffer = b""
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,139 @@
+from concurrent.futures import Future
+import heapq
+import itertools
+import threading
+import time
+import typing
+
+from .setup_logger import logger
+
+
+class Priority:
+    """ Lower values run first. """
+    SEND_SMS = 0
+    RECEIVE_SMS = 10
+    DEFAULT = 20
+    TELEMETRY = 30
+
+
+class Command_Executor:
+    """
+    Runs complete command transactions on a device from a single worker
+    thread, ordered by priority and then by submission.
+
+    A transaction is any callable, called with the arguments given to
+    submit(), typically a bound method of the device like
+    GSM_Device.send_sms, so multi-step exchanges such as the
+    AT+CMGS prompt are never interleaved with other commands. The device
+    lock is held while a transaction runs, so direct callers that use
+    "with device.lock:" are serialized with the executor as well.
+
+    A running transaction cannot be preempted, so an urgent job waits for
+    at most the one transaction currently running.
+    """
+
+    def __init__(self, device, max_pending: int = 0):
+        """ max_pending limits the queue length, 0 means unlimited. """
+        self.device = device
+        self.max_pending = max_pending
+
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.started = 0
+        self.completed = 0
+        self.expired = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, fn: typing.Callable, *args, priority: int = Priority.DEFAULT,
+               deadline: float = None, **kwargs) -> Future:
+        """
+        Queue fn(*args, **kwargs) and return a Future for its result.
+
+        deadline is a number of seconds: a job that has not started by then
+        fails with TimeoutError. Cancel a queued job with Future.cancel().
+        Raises OverflowError if max_pending jobs are already queued.
+        """
+        future = Future()
+        now = time.monotonic()
+        expires = now + deadline if deadline is not None else None
+
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("Executor is shut down")
+            if self.max_pending and len(self.queue) >= self.max_pending:
+                raise OverflowError("Too many pending commands")
+
+            job = (fn, args, kwargs, future, now, expires)
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.condition.notify()
+
+        return future
+
+    def get_queue_depth(self) -> int:
+        return len(self.queue)
+
+    def get_stats(self) -> dict:
+        """ Queue depth, job counts and wait times in seconds of started jobs. """
+        average = self.total_wait / self.started if self.started else 0.0
+        return {
+            "depth": len(self.queue),
+            "started": self.started,
+            "completed": self.completed,
+            "expired": self.expired,
+            "last_wait": self.last_wait,
+            "max_wait": self.max_wait,
+            "average_wait": average,
+        }
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                _, _, job = heapq.heappop(self.queue)
+
+            fn, args, kwargs, future, queued, expires = job
+            now = time.monotonic()
+            if expires is not None and now > expires:
+                self.expired += 1
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(TimeoutError("Deadline passed before command started"))
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            wait = now - queued
+            self.last_wait = wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_wait += wait
+            self.started += 1
+
+            try:
+                with self.device.lock:
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                logger.debug(f"Command transaction failed: {e}")
+                self.completed += 1
+                future.set_exception(e)
+            else:
+                self.completed += 1
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True):
+        """ Stop accepting jobs. Queued jobs are still run. """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if wait:
+            self.worker.join()
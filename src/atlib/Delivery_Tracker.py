@@ -0,0 +1,173 @@
+from collections import OrderedDict, deque
+import threading
+import time
+import typing
+
+
+class Delivery_State:
+    PENDING = "PENDING"
+    DELIVERED = "DELIVERED"
+    FAILED = "FAILED"
+    EXPIRED = "EXPIRED"
+
+
+class Delivery:
+    """ Delivery state of one sent message. """
+    __slots__ = ("modem", "mr", "number", "sent_at", "reported_at", "state", "status")
+
+    def __init__(self, modem: str, mr: int, number: str = None):
+        self.modem = modem
+        self.mr = mr
+        self.number = number
+        self.sent_at = time.monotonic()
+        self.reported_at: float = None
+        self.state = Delivery_State.PENDING
+        self.status: int = None
+
+    def get_latency(self) -> float:
+        """ Seconds from sending until the final report, None before. """
+        if self.reported_at is None:
+            return None
+        return self.reported_at - self.sent_at
+
+    def __repr__(self):
+        return f"({self.modem}, {self.mr}, {self.number}, {self.state}, {self.status})"
+
+
+class Delivery_Tracker:
+    """
+    Matches SMS status reports to sent messages by (modem, message reference).
+
+    Messages are registered by GSM_Device.send_sms(status_report=True) and
+    resolved by the +CDS/+CDSI reports enabled with
+    GSM_Device.enable_delivery_reports(). Entries without final report are
+    marked expired after ttl seconds. Message references wrap at 256, so ttl
+    should stay below the time a modem takes to send 256 messages.
+
+    Delivered, failed and expired messages stay queryable for another ttl
+    seconds, keeping at most max_resolved of them.
+    """
+
+    def __init__(self, ttl: float = 86400, window: int = 1000, max_resolved: int = 10000):
+        self.ttl = ttl
+        self.max_resolved = max_resolved
+        self.lock = threading.Lock()
+
+        self.pending: typing.Dict[typing.Tuple[str, int], Delivery] = {}
+        # Finished messages with the time they finished, oldest first.
+        self.resolved: typing.Dict[typing.Tuple[str, int], typing.Tuple[float, Delivery]] = OrderedDict()
+        self.latencies: typing.Dict[str, deque] = {}
+        self.window = window
+
+        self.delivered = 0
+        self.failed = 0
+        self.expired = 0
+
+    def sent(self, modem: str, mr: int, number: str = None) -> Delivery:
+        """ Register a message sent with a status report request. """
+        delivery = Delivery(modem, mr, number)
+        with self.lock:
+            # Message references wrap, a new message replaces an old result.
+            self.resolved.pop((modem, mr), None)
+            self.pending[(modem, mr)] = delivery
+        return delivery
+
+    def resolve(self, key: typing.Tuple[str, int], delivery: Delivery, now: float):
+        """ Move a finished message from pending to resolved. Lock held. """
+        del self.pending[key]
+        self.resolved[key] = (now, delivery)
+        while len(self.resolved) > self.max_resolved:
+            self.resolved.popitem(last=False)
+
+    def report(self, modem: str, mr: int, status: int) -> Delivery:
+        """
+        Resolve a message by the status of its report (TP-ST). Returns the
+        delivery or None if the message is unknown or already expired.
+        """
+        with self.lock:
+            delivery = self.pending.get((modem, mr))
+            if delivery is None:
+                return None
+
+            delivery.status = status
+            # 0x20-0x3F: temporary error, the SC is still trying.
+            if 0x20 <= status <= 0x3F:
+                return delivery
+
+            delivery.reported_at = time.monotonic()
+            self.resolve((modem, mr), delivery, delivery.reported_at)
+            if status <= 0x1F:
+                delivery.state = Delivery_State.DELIVERED
+                self.delivered += 1
+            else:
+                delivery.state = Delivery_State.FAILED
+                self.failed += 1
+
+            latencies = self.latencies.setdefault(modem, deque(maxlen=self.window))
+            latencies.append(delivery.get_latency())
+        return delivery
+
+    def expire(self) -> typing.List[Delivery]:
+        """
+        Mark pending messages older than ttl as expired and return them.
+        Finished messages older than ttl are dropped.
+        """
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for key, delivery in list(self.pending.items()):
+                if now - delivery.sent_at > self.ttl:
+                    delivery.state = Delivery_State.EXPIRED
+                    self.resolve(key, delivery, now)
+                    expired.append(delivery)
+            self.expired += len(expired)
+
+            while self.resolved:
+                key, (finished_at, _) = next(iter(self.resolved.items()))
+                if now - finished_at <= self.ttl:
+                    break
+                del self.resolved[key]
+        return expired
+
+    def get_delivery(self, modem: str, mr: int) -> Delivery:
+        """ Pending or finished message, None if unknown or dropped. """
+        self.expire()
+        with self.lock:
+            delivery = self.pending.get((modem, mr))
+            if delivery is None and (modem, mr) in self.resolved:
+                delivery = self.resolved[(modem, mr)][1]
+        return delivery
+
+    def get_state(self, modem: str, mr: int) -> str:
+        """ State of a message, see Delivery_State. None if unknown. """
+        delivery = self.get_delivery(modem, mr)
+        return delivery.state if delivery else None
+
+    def get_latency_percentiles(
+        self,
+        modem: str = None,
+        percentiles: typing.Iterable[float] = (0.5, 0.9, 0.99)
+    ) -> typing.Dict[float, float]:
+        """
+        Delivery latency percentiles in seconds over the recent reports of
+        one modem, or of all modems. Empty if there are no reports.
+        """
+        with self.lock:
+            if modem is not None:
+                samples = list(self.latencies.get(modem, ()))
+            else:
+                samples = [s for latencies in self.latencies.values() for s in latencies]
+
+        samples.sort()
+        if not samples:
+            return {}
+        return {p: samples[min(len(samples) - 1, int(p * len(samples)))] for p in percentiles}
+
+    def get_stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "resolved": len(self.resolved),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "expired": self.expired,
+        }
@@ -0,0 +1,247 @@
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import typing
+
+from .Command_Executor import Command_Executor
+from .GSM_Device import GSM_Device
+from .Status import Status
+from .setup_logger import logger
+
+# Counters kept per modem in shared memory, in this order.
+STATS = ("sent", "received", "errors", "commands", "latency")
+SENT, RECEIVED, ERRORS, COMMANDS, LATENCY = range(len(STATS))
+
+# Weight of the newest sample in the latency average.
+LATENCY_ALPHA = 0.2
+
+
+def run_command(id: int, device, name: str, method: str, args, kwargs,
+                base: int, send: typing.Callable, stats):
+    """ Run one command on its device executor thread and send the result. """
+    start_time = time.monotonic()
+    try:
+        if method.startswith("_"):
+            raise AttributeError(f"{method} is private")
+
+        device.last_error = None
+        value = getattr(device, method)(*args, **kwargs)
+        ok = True
+    except Exception as e:
+        value = e
+        ok = False
+
+    latency = time.monotonic() - start_time
+    stats[base + COMMANDS] += 1
+    if stats[base + COMMANDS] == 1:
+        stats[base + LATENCY] = latency
+    else:
+        stats[base + LATENCY] += LATENCY_ALPHA * (latency - stats[base + LATENCY])
+
+    if not ok or device.last_error is not None:
+        stats[base + ERRORS] += 1
+    elif method == "send_sms" and value == Status.OK:
+        stats[base + SENT] += 1
+    elif method == "receive_sms" and isinstance(value, list):
+        stats[base + RECEIVED] += len(value)
+
+    # The result is pickled before anything is written, so a result that
+    # cannot be sent leaves the pipe intact.
+    try:
+        send((id, ok, value))
+    except Exception as e:
+        send((id, False, RuntimeError(f"Result of {name}.{method} not transferable: {e}")))
+
+
+def run_worker(ports: typing.Dict[str, str], indexes: typing.Dict[str, int],
+               device_class, device_kwargs: dict, commands, results, stats):
+    """
+    Worker process owning the devices of one shard. Runs commands until it
+    receives None, on one Command_Executor per device, so a slow command
+    only delays its own modem. Counters of a modem in stats are only
+    written by its executor thread, so no locking is needed.
+    """
+    devices = {}
+    for name, path in ports.items():
+        try:
+            devices[name] = device_class(path, **device_kwargs)
+        except Exception as e:
+            logger.debug(f"Opening {name} at {path} failed: {e}")
+    executors = {name: Command_Executor(device) for name, device in devices.items()}
+
+    # The result pipe is shared by the executor threads.
+    send_lock = threading.Lock()
+
+    def send(result):
+        with send_lock:
+            results.send(result)
+
+    while True:
+        job = commands.get()
+        if job is None:
+            break
+
+        id, name, method, args, kwargs = job
+        if name not in executors:
+            send((id, False, ConnectionError(f"Device {name} is not open")))
+            continue
+        executors[name].submit(run_command, id, devices[name], name, method, args, kwargs,
+                               indexes[name] * len(STATS), send, stats)
+
+    for executor in executors.values():
+        executor.shutdown()
+
+
+class Fleet_Runner:
+    """
+    Spreads a fleet of modems over worker processes, each owning the device
+    objects of its shard, so parsing and logging scale across cores.
+
+    Commands are device method calls, sent to the owning worker over a
+    queue and answered through a result pipe per worker. Per-modem counters
+    (see STATS) live in a shared memory array the parent reads directly.
+    If a worker process dies, the commands of its modems fail.
+    """
+
+    def __init__(
+        self,
+        ports: typing.Dict[str, str],
+        device_class=GSM_Device,
+        processes: int = None,
+        device_kwargs: dict = None
+    ):
+        """ ports maps modem names to device paths. processes defaults to the CPU count. """
+        self.names = sorted(ports)
+        self.indexes = {name: i for i, name in enumerate(self.names)}
+        processes = max(1, min(processes or os.cpu_count() or 1, len(self.names)))
+
+        # Round robin, so neighbouring ports end up on different cores.
+        shards = [{} for _ in range(processes)]
+        self.shard_of = {}
+        for i, name in enumerate(self.names):
+            shards[i % processes][name] = ports[name]
+            self.shard_of[name] = i % processes
+
+        self.stats = multiprocessing.Array("d", len(self.names) * len(STATS), lock=False)
+        self.queues = [multiprocessing.Queue() for _ in range(processes)]
+        # One pipe per worker, a dying worker cannot block the others.
+        pipes = [multiprocessing.Pipe(duplex=False) for _ in range(processes)]
+        self.readers = [reader for reader, _ in pipes]
+        self.writers = [writer for _, writer in pipes]
+        self.workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(shard, self.indexes, device_class, device_kwargs or {},
+                      queue, writer, self.stats),
+                daemon=True,
+            )
+            for shard, queue, writer in zip(shards, self.queues, self.writers)
+        ]
+
+        self.counter = itertools.count()
+        # Futures by command id, with the shard running the command.
+        self.futures: typing.Dict[int, typing.Tuple[Future, int]] = {}
+        self.dead: typing.Set[int] = set()
+        self.stopping = threading.Event()
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        # The parent only reads from the result pipes.
+        for writer in self.writers:
+            writer.close()
+        self.collector.start()
+
+    def submit(self, name: str, method: str, *args, **kwargs) -> Future:
+        """ Call a device method in its worker, e.g. submit("modem1", "send_sms", nr, msg). """
+        id = next(self.counter)
+        future = Future()
+        shard = self.shard_of[name]
+        if shard in self.dead:
+            future.set_exception(RuntimeError(f"Worker process of {name} has exited"))
+            return future
+
+        self.futures[id] = (future, shard)
+        self.queues[shard].put((id, name, method, args, kwargs))
+        return future
+
+    def collect(self):
+        """ Resolve futures from the result pipes until all workers exited. """
+        readers = {reader: shard for shard, reader in enumerate(self.readers)}
+        sentinels = {worker.sentinel: shard for shard, worker in enumerate(self.workers)}
+        while sentinels:
+            ready = wait(list(readers) + list(sentinels), timeout=1)
+            if not ready and self.stopping.is_set():
+                return
+
+            for item in ready:
+                if item in readers:
+                    try:
+                        self.resolve(*item.recv())
+                    except EOFError:
+                        del readers[item]
+                elif item in sentinels:
+                    shard = sentinels.pop(item)
+                    self.worker_exited(shard)
+                    readers.pop(self.readers[shard], None)
+
+    def resolve(self, id: int, ok: bool, value):
+        future, _ = self.futures.pop(id, (None, None))
+        if future is None:
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def worker_exited(self, shard: int):
+        """ Collect the last results of a worker and fail its other commands. """
+        reader = self.readers[shard]
+        try:
+            while reader.poll():
+                self.resolve(*reader.recv())
+        except (EOFError, OSError):
+            pass
+
+        self.dead.add(shard)
+        # The sentinel fires just before the process can be reaped.
+        self.workers[shard].join(1)
+        code = self.workers[shard].exitcode
+        if code:
+            logger.debug(f"Fleet worker {shard} exited with code {code}")
+        self.fail_pending(RuntimeError(f"Worker process exited with code {code}"), shard)
+
+    def fail_pending(self, error: Exception, shard: int = None):
+        """ Fail commands still waiting for a result, of one shard or all. """
+        for id, (future, future_shard) in list(self.futures.items()):
+            if shard is not None and future_shard != shard:
+                continue
+            self.futures.pop(id, None)
+            if not future.done():
+                future.set_exception(error)
+
+    def get_stats(self, name: str) -> typing.Dict[str, float]:
+        """ Counters of one modem, read without locking. """
+        base = self.indexes[name] * len(STATS)
+        return dict(zip(STATS, self.stats[base:base + len(STATS)]))
+
+    def get_all_stats(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        return {name: self.get_stats(name) for name in self.names}
+
+    def stop(self, timeout: float = None):
+        """
+        Let the workers finish queued commands and exit. Commands without
+        result by then fail with RuntimeError.
+        """
+        for queue in self.queues:
+            queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.stopping.set()
+        self.collector.join(timeout)
+        self.fail_pending(RuntimeError("Fleet runner stopped before the command finished"))
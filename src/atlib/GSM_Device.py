@@ -1,13 +1,21 @@
+import threading
 import time
 import typing
 import re
 
 from .SMS_Group import SMS_Group
+from .SMS_Storage import SMS_Storage
 from .Status import Status
 from .AT_Device import AT_Device
+from .Delivery_Tracker import Delivery_Tracker
 from .Operator import Operator
 from .setup_logger import logger
 from .helpers import is_valid_operator, sanitize_operator
+from .named_tuples import StorageInfo
+
+# Registration states of AT+CREG meaning registered (home, roaming),
+# see GSM_Device.get_network_registration().
+REGISTERED = (1, 5)
 
 
 class GSM_Device(AT_Device):
@@ -20,13 +28,226 @@ class GSM_Device(AT_Device):
     understand the functionality within this file.
     """
 
-    def __init__(self, path: str, baudrate: int = 9600):
+    # AT+CSCLK mode used by enable_sleep(). 1 sleeps while DTR is released,
+    # 2 sleeps whenever the serial line is idle and wakes on incoming data.
+    SLEEP_MODE = 2
+
+    # Line idle time after which a device in mode 2 may be asleep. The chips
+    # do not document it exactly, so it is kept short.
+    UART_SLEEP_DELAY = 0.5
+
+    # Bounds of the delay between wake signal and first command.
+    MIN_WAKE_DELAY = 0.02
+    MAX_WAKE_DELAY = 1.0
+    WAKE_PROBE_TIMEOUT = 0.3
+    WAKE_ATTEMPTS = 4
+
+    def __init__(self, path: str, baudrate: int = 9600, **kwargs):
         """ Open GSM Device. Device sim still needs to be unlocked. """
         logger.debug("Opening GSM device")
-        super().__init__(path, baudrate)
+
+        # Power state, see enable_sleep(). Set before opening as write()
+        # checks it.
+        self.sleep_mode = 0
+        self.asleep = False
+        self.idle_timeout = 5.0
+        self.wake_delay = 0.1
+        self.last_activity = time.monotonic()
+        self.sleep_started = 0.0
+        self.time_asleep = 0.0
+        self.wakes = 0
+        self.wake_failures = 0
+        self.last_wake_latency = 0.0
+        self.max_wake_latency = 0.0
+        self.sleep_thread: threading.Thread = None
+        self.sleep_stop = threading.Event()
+
+        super().__init__(path, baudrate, **kwargs)
         while self.sync_baudrate() != Status.OK:
             time.sleep(1)
 
+        # Fraction of used SMS storage at which receive_sms() purges read
+        # messages, see set_sms_high_water().
+        self.sms_high_water = None
+
+        # Message reference of the last sent SMS, see enable_delivery_reports.
+        self.last_message_reference = None
+        self.delivery_tracker: Delivery_Tracker = None
+        self.pending_status_reports: typing.List[int] = []
+
+    def set_error_mode(self, mode: int = 1) -> str:
+        """
+        Select how errors are reported. Returns status.
+
+        mode:
+          - 0: Bare ERROR
+          - 1: Numeric +CME ERROR/+CMS ERROR codes
+          - 2: Verbose +CME ERROR/+CMS ERROR messages
+        """
+        self.write(f"AT+CMEE={mode}")
+        return self.read_status("Error mode")
+
+    def write(self, cmd: str, endline: bool = True) -> str:
+        """ Wake the device if it sleeps, then write. See AT_Device.write. """
+        with self.lock:
+            self.update_sleep_state()
+            if self.asleep:
+                self.wake()
+            self.last_activity = time.monotonic()
+            return super().write(cmd, endline)
+
+    def read(self, timeout: float = None, stopterm: str = "") -> typing.List[str]:
+        # Holding the lock keeps the device awake until the response is in.
+        with self.lock:
+            try:
+                return super().read(timeout, stopterm)
+            finally:
+                self.last_activity = time.monotonic()
+
+    def set_dtr(self, active: bool):
+        """ Assert or release DTR. Ports without modem lines ignore it. """
+        try:
+            self.serial.dtr = active
+        except (AttributeError, OSError, ValueError) as e:
+            logger.debug(f"Setting DTR failed: {e}")
+
+    def enable_sleep(self, idle_timeout: float = None, mode: int = None) -> str:
+        """
+        Let the device sleep when idle. Commands wake it again before they
+        are written. Returns status.
+
+        mode defaults to SLEEP_MODE. In mode 1, which requires DTR to be
+        wired, DTR is released after idle_timeout seconds without commands,
+        5 by default. In mode 2 the device sleeps by itself once the line is
+        idle, and commands after idle_timeout seconds of silence, by default
+        UART_SLEEP_DELAY, are preceded by a wake preamble.
+        """
+        mode = mode or self.SLEEP_MODE
+        if idle_timeout is None:
+            idle_timeout = 5 if mode == 1 else self.UART_SLEEP_DELAY
+        with self.lock:
+            self.set_dtr(True)
+            self.write(f"AT+CSCLK={mode}")
+            status = self.read_status("Enable sleep")
+            if status != Status.OK:
+                return status
+
+            self.sleep_mode = mode
+            self.idle_timeout = idle_timeout
+
+        if mode == 1 and (self.sleep_thread is None or not self.sleep_thread.is_alive()):
+            self.sleep_stop.clear()
+            self.sleep_thread = threading.Thread(target=self.sleep_when_idle, daemon=True)
+            self.sleep_thread.start()
+        return Status.OK
+
+    def disable_sleep(self) -> str:
+        """ Wake the device and keep it awake. Returns status. """
+        self.sleep_stop.set()
+        with self.lock:
+            self.write("AT+CSCLK=0")
+            self.sleep_mode = 0
+            return self.read_status("Disable sleep")
+
+    def sleep_when_idle(self):
+        while not self.sleep_stop.wait(min(1, self.idle_timeout / 4)):
+            if self.asleep or self.awaiting_response:
+                continue
+            if time.monotonic() - self.last_activity < self.idle_timeout:
+                continue
+            # Skip while another thread is in a command.
+            if self.lock.acquire(blocking=False):
+                try:
+                    self.enter_sleep()
+                finally:
+                    self.lock.release()
+
+    def update_sleep_state(self):
+        """ In mode 2, the device is taken as asleep once the line was idle long enough. """
+        if self.sleep_mode != 2 or self.asleep:
+            return
+        fell_asleep = self.last_activity + self.idle_timeout
+        if time.monotonic() >= fell_asleep:
+            self.asleep = True
+            self.sleep_started = fell_asleep
+
+    def enter_sleep(self):
+        """
+        Let the device sleep now. In mode 2 the device falls asleep by
+        itself once the line is idle, this only starts accounting for it.
+        """
+        with self.lock:
+            if self.asleep or not self.sleep_mode:
+                return
+            if self.sleep_mode == 1:
+                self.set_dtr(False)
+            self.asleep = True
+            self.sleep_started = time.monotonic()
+            logger.debug("GSM device sleeping")
+
+    def wake(self) -> bool:
+        """
+        Wake the device and wait until it answers AT. Returns True if it did.
+
+        The delay between wake signal and probe is tuned at runtime: it
+        shrinks while the device answers the first probe and grows up to
+        MAX_WAKE_DELAY when it does not, so waking takes at most
+        WAKE_ATTEMPTS probes.
+        """
+        with self.lock:
+            if not self.asleep:
+                return True
+
+            start_time = time.monotonic()
+            self.time_asleep += start_time - self.sleep_started
+            self.asleep = False
+
+            delay = self.wake_delay
+            answered = False
+            for attempt in range(self.WAKE_ATTEMPTS):
+                if self.sleep_mode == 1:
+                    self.set_dtr(True)
+                else:
+                    # Wakes the UART, the first bytes may be lost.
+                    self.write_raw(b"AT\r\n")
+                time.sleep(delay)
+
+                super().write("AT")
+                if self.read(self.WAKE_PROBE_TIMEOUT)[-1] == Status.OK:
+                    answered = True
+                    break
+                delay = min(self.MAX_WAKE_DELAY, delay * 2)
+
+            if answered and attempt == 0:
+                self.wake_delay = max(self.MIN_WAKE_DELAY, delay * 0.8)
+            else:
+                self.wake_delay = delay
+
+            latency = time.monotonic() - start_time
+            self.wakes += 1
+            self.last_wake_latency = latency
+            self.max_wake_latency = max(self.max_wake_latency, latency)
+            if not answered:
+                self.wake_failures += 1
+            logger.debug(f"GSM device woke after {latency:.3f}s, answered: {answered}")
+            return answered
+
+    def get_sleep_stats(self) -> dict:
+        """ Time asleep and wake latency in seconds. """
+        self.update_sleep_state()
+        time_asleep = self.time_asleep
+        if self.asleep:
+            time_asleep += time.monotonic() - self.sleep_started
+        return {
+            "asleep": self.asleep,
+            "time_asleep": time_asleep,
+            "wakes": self.wakes,
+            "wake_failures": self.wake_failures,
+            "wake_delay": self.wake_delay,
+            "last_wake_latency": self.last_wake_latency,
+            "max_wake_latency": self.max_wake_latency,
+        }
+
     def reboot(self) -> str:
         """ Reboot the GSM device. Returns status. """
         logger.debug("Rebooting GSM device")
@@ -76,11 +297,12 @@ class GSM_Device(AT_Device):
 
         # Wait until unlocked.
         logger.debug("Awaiting SMS ready status")
-        self.read(stopterm="SMS Ready")
+        self.read(timeout=10, stopterm="SMS Ready")
         logger.debug("Sim unlocked")
         return Status.OK
 
-    def send_sms(self, nr: str, msg: str, dcs: int = 0) -> str:
+    def send_sms(self, nr: str, msg: str, dcs: int = 0,
+                 status_report: bool = False) -> str:
         """
         Sends a text message to specified number.
         Returns status.
@@ -88,6 +310,9 @@ class GSM_Device(AT_Device):
         dcs:
           - 0: Standard SMS
           -16: Flash
+
+        With status_report, a delivery report is requested and the message
+        is registered with the delivery tracker, if one is set.
         """
         logger.debug(f"Sending \"{msg}\" to {nr}.")
 
@@ -103,7 +328,10 @@ class GSM_Device(AT_Device):
         if status != Status.OK:
             return status
 
-        self.write(f"AT+CSMP=17,167,0,{dcs}")
+        # First octet: SMS-SUBMIT with relative validity period (17),
+        # plus the status report request bit (32).
+        fo = 49 if status_report else 17
+        self.write(f"AT+CSMP={fo},167,0,{dcs}")
         status = self.read_status("SMS mode")
         if status != Status.OK:
             return status
@@ -116,7 +344,20 @@ class GSM_Device(AT_Device):
         self.write(msg, endline=False)
         # self.read()
         self.write_ctrlz()
-        status = self.read_status("Sending message")
+        resp = self.read()
+        status = resp[-1]
+        if status != Status.OK:
+            logger.debug(f"{status}: Sending message")
+            return status
+
+        # +CMGS: <mr>
+        self.last_message_reference = None
+        for line in resp:
+            if line.startswith("+CMGS:"):
+                self.last_message_reference = int(line.split(":")[1].strip())
+
+        if status_report and self.delivery_tracker and self.last_message_reference is not None:
+            self.delivery_tracker.sent(self.path, self.last_message_reference, nr)
 
         logger.debug("Message sent.")
         return status
@@ -159,6 +400,10 @@ class GSM_Device(AT_Device):
             time = header[5].split("+")[0]
             el = [sender, date, time, message]
             table.append(el)
+
+        if self.sms_high_water is not None:
+            self.purge_sms()
+
         return table
 
     def delete_read_sms(self) -> str:
@@ -167,6 +412,146 @@ class GSM_Device(AT_Device):
         self.write("AT+CMGD=1,3")
         return self.read_status("Deleting message")
 
+    def delete_sms(self, index: int) -> str:
+        """ Delete a single message by storage index. """
+        self.write(f"AT+CMGD={index}")
+        return self.read_status(f"Deleting message {index}")
+
+    def delete_sms_range(self, indices: typing.Iterable[int]) -> str:
+        """
+        Delete messages by a list or range of storage indices.
+        Returns the first failing status, or OK if all were deleted.
+        """
+        self.reset_state()
+        result = Status.OK
+        for index in indices:
+            status = self.delete_sms(index)
+            if status != Status.OK and result == Status.OK:
+                result = status
+        return result
+
+    def get_sms_storage(self) -> typing.List[StorageInfo]:
+        """
+        Get used/total message slots of the preferred storages.
+        Returns one entry each for read/delete, write/send and receive memory.
+        """
+        self.write("AT+CPMS?")
+        resp = self.read()
+        if resp[-1] != Status.OK:
+            return []
+
+        # +CPMS: "SM",5,30,"SM",5,30,"SM",5,30
+        value = resp[1].split(":")[1].strip()
+        fields = [f.strip().strip('"') for f in value.split(",")]
+
+        storages = []
+        for i in range(0, len(fields) - 2, 3):
+            storages.append(StorageInfo(fields[i], int(fields[i + 1]), int(fields[i + 2])))
+        return storages
+
+    def set_sms_storage(self, read: str = SMS_Storage.PHONE,
+                        write: str = None, receive: str = None) -> str:
+        """
+        Select preferred message storage. See SMS_Storage for memories.
+        Write and receive memory default to the read memory.
+        """
+        write = write or read
+        receive = receive or read
+        self.write(f"AT+CPMS=\"{read}\",\"{write}\",\"{receive}\"")
+        return self.read_status("Selecting SMS storage")
+
+    def set_sms_high_water(self, fraction: float = None):
+        """
+        Let receive_sms() purge read messages once a storage is filled to
+        fraction, e.g. 0.8. None disables the automatic purge.
+        """
+        if fraction is not None and not 0 < fraction <= 1:
+            raise ValueError(f"High-water mark must be in (0, 1], got {fraction}")
+        self.sms_high_water = fraction
+
+    def purge_sms(self, high_water: float = None) -> str:
+        """
+        Delete read messages if any storage is filled to the high-water mark,
+        by default the one set with set_sms_high_water(). Unread messages are
+        never deleted. Returns status, OK without a mark.
+        """
+        if high_water is None:
+            high_water = self.sms_high_water
+        if high_water is None:
+            return Status.OK
+
+        for storage in self.get_sms_storage():
+            if storage.total > 0 and storage.used / storage.total >= high_water:
+                logger.debug(f"SMS storage {storage.memory} at {storage.used}/{storage.total}, purging")
+                return self.delete_read_sms()
+
+        return Status.OK
+
+    def enable_delivery_reports(self, tracker: Delivery_Tracker,
+                                stored: bool = False) -> str:
+        """
+        Route SMS status reports to the tracker.
+
+        By default reports are sent directly as +CDS. With stored, they are
+        saved and announced as +CDSI; fetch them with fetch_status_reports().
+        Reports are picked up by every command and by poll_urcs().
+        """
+        self.delivery_tracker = tracker
+        self.remove_urc_handler("+CDS:", self.handle_status_report)
+        self.remove_urc_handler("+CDSI:", self.handle_status_report_index)
+        self.add_urc_handler("+CDS:", self.handle_status_report)
+        self.add_urc_handler("+CDSI:", self.handle_status_report_index)
+
+        self.write("AT+CMGF=1")
+        status = self.read_status("Text mode")
+        if status != Status.OK:
+            return status
+
+        ds = 2 if stored else 1
+        self.write(f"AT+CNMI=2,1,0,{ds},0")
+        return self.read_status("Routing status reports")
+
+    def parse_status_report(self, fields: typing.List[str]):
+        """ Pass <fo>,<mr>,...,<st> of a text mode status report to the tracker. """
+        mr = int(fields[1])
+        st = int(fields[-1])
+        logger.debug(f"Status report mr={mr} st={st}")
+        if self.delivery_tracker:
+            self.delivery_tracker.report(self.path, mr, st)
+
+    def handle_status_report(self, line: str):
+        # +CDS: <fo>,<mr>,[<ra>],[<tora>],<scts>,<dt>,<st>
+        fields = line.split(":", 1)[1].strip().split(",")
+        self.parse_status_report(fields)
+
+    def handle_status_report_index(self, line: str):
+        # +CDSI: <mem>,<index>
+        index = int(line.split(",")[-1])
+        self.pending_status_reports.append(index)
+
+    def fetch_status_reports(self) -> int:
+        """
+        Read and delete status reports announced by +CDSI.
+        Returns the number of reports passed to the tracker.
+        """
+        fetched = 0
+        while self.pending_status_reports:
+            index = self.pending_status_reports.pop(0)
+            self.write(f"AT+CMGR={index}")
+            resp = self.read()
+            if resp[-1] != Status.OK:
+                continue
+
+            # +CMGR: <stat>,<fo>,<mr>,[<ra>],[<tora>],<scts>,<dt>,<st>
+            for line in resp:
+                if line.startswith("+CMGR:"):
+                    fields = line.split(":", 1)[1].strip().split(",")
+                    self.parse_status_report(fields[1:])
+                    fetched += 1
+
+            self.delete_sms(index)
+        return fetched
+
     def get_current_operator(self) -> str:
         """ Get current operator string. """
         self.write("AT+COPS?")
@@ -185,7 +570,7 @@ class GSM_Device(AT_Device):
 
     def get_available_operators(self) -> typing.List[Operator]:
         self.write("AT+COPS=?")
-        resp = self.read(timeout=30)
+        resp = self.read()
         operators = resp[1].split(":")[1].strip()
         operators = operators.split("),")
         operators = list(map(lambda x: re.sub(r',?\(|\)', '', x), operators))
@@ -1,13 +1,15 @@
-from typing import List
+from typing import Dict, List, Tuple
 
 from atlib.GSM_Device import GSM_Device
-from atlib.named_tuples import Context, Address
+from atlib.Status import Status
+from atlib.named_tuples import Context, Address, ContextSpec
+from atlib.setup_logger import logger
 from atlib.named_tuples import SignalQualityInfo
 
 
 class LTE_Device(GSM_Device):
-    def __init__(self, path: str, baudrate: int = 115200):
-        super().__init__(path, baudrate)
+    def __init__(self, path: str, baudrate: int = 115200, **kwargs):
+        super().__init__(path, baudrate, **kwargs)
 
     def get_signal_quality(self) -> SignalQualityInfo:
         self.write("AT+CESQ")
@@ -18,6 +20,15 @@ class LTE_Device(GSM_Device):
 
         return SignalQualityInfo(rsrq=int(rsrq), rsrp=int(rsrp))
 
+    def get_eps_registration(self) -> Tuple[int, int]:
+        """ LTE (EPS) registration as (n, stat), see get_network_registration(). """
+        self.write("AT+CEREG?")
+        resp = self.read()
+        value = resp[1].split(":")[1].strip().replace("\"", "")
+        fields = value.split(",")
+
+        return (int(fields[0]), int(fields[1]))
+
     def get_contexts(self) -> List[Context]:
         self.write("AT+CGDCONT?")
         response = self.read()
@@ -70,3 +81,85 @@ class LTE_Device(GSM_Device):
         self.write(f"AT+CGACT=1,{id}")
 
         return self.read_status()
+
+    def get_context_states(self) -> Dict[int, bool]:
+        """Activation state of each context by id."""
+        self.write("AT+CGACT?")
+        response = self.read()
+
+        states: Dict[int, bool] = {}
+        for line in response:
+            if line.startswith('+CGACT:'):
+                id, state = line.split(":")[1].strip().split(",")[:2]
+                states[int(id)] = int(state) == 1
+
+        return states
+
+    def reconcile_contexts(
+        self,
+        desired: List[ContextSpec],
+        delete_unlisted: bool = False,
+        max_line: int = 256
+    ) -> str:
+        """Bring contexts to the desired state with as few commands as possible.
+
+        Only contexts whose type or APN differ are rewritten, and only
+        contexts whose activation state differs are (de)activated, so
+        unchanged contexts do not cause a re-attach. All changes are sent as
+        one command line (split only if longer than max_line). Returns ERROR
+        if an active context has no address assigned afterwards.
+        """
+        current = {context.id: context for context in self.get_contexts()}
+        states = self.get_context_states()
+        commands = []
+
+        if delete_unlisted:
+            wanted = {spec.id for spec in desired}
+            for id in current:
+                if id not in wanted:
+                    if states.get(id):
+                        commands.append(f"+CGACT=0,{id}")
+                    commands.append(f"+CGDCONT={id}")
+
+        for spec in desired:
+            context = current.get(spec.id)
+            active = states.get(spec.id, False)
+            changed = (
+                context is None
+                or context.type.upper() != spec.type.upper()
+                or context.apn.lower() != spec.apn.lower()
+            )
+            if changed:
+                if active:
+                    commands.append(f"+CGACT=0,{spec.id}")
+                    active = False
+                commands.append(f"+CGDCONT={spec.id},\"{spec.type}\",\"{spec.apn}\"")
+
+            if spec.active and not active:
+                commands.append(f"+CGACT=1,{spec.id}")
+            elif not spec.active and active:
+                commands.append(f"+CGACT=0,{spec.id}")
+
+        # Concatenate commands into as few lines as possible.
+        lines = []
+        for command in commands:
+            if lines and len(lines[-1]) + len(command) + 1 <= max_line:
+                lines[-1] += ";" + command
+            else:
+                lines.append("AT" + command)
+
+        for line in lines:
+            self.write(line)
+            status = self.read_status("Reconciling contexts")
+            if status != Status.OK:
+                return status
+
+        active_ids = [spec.id for spec in desired if spec.active]
+        if active_ids:
+            addresses = {address.id: address.ip for address in self.get_addresses()}
+            for id in active_ids:
+                if addresses.get(id) in (None, "", "0.0.0.0"):
+                    logger.debug(f"Context {id} has no address")
+                    return Status.ERROR
+
+        return Status.OK
@@ -1,12 +1,45 @@
-from typing import List
+from collections import deque
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
+import os
 import re
+import time
+import zlib
 
 from atlib import LTE_Device
+from atlib.SIM7600GH_Socket import SIM7600GH_Socket, find_line
+from atlib.Status import Status
+from atlib.helpers import parse_gnss_info, parse_gps_info
+from atlib.named_tuples import GNSSFix, ServingCell
+from atlib.setup_logger import logger
+
+
+class CRC32_Writer:
+    """Write-only file object keeping just the CRC32 of the data."""
+
+    def __init__(self):
+        self.crc = 0
+
+    def write(self, data: bytes) -> int:
+        self.crc = zlib.crc32(data, self.crc)
+        return len(data)
+
+
+# LTE bands of the global SIM7600G-H variant according to its datasheet.
+SUPPORTED_BANDS = [1, 2, 3, 4, 5, 7, 8, 12, 13, 18, 19, 20, 25, 26, 28, 34, 38, 39, 40, 41, 66]
 
 
 class SIM7600GH(LTE_Device):
-    def __init__(self, path: str, baudrate: int = 115200):
-        super().__init__(path, baudrate)
+    # Only DTR controlled sleep is supported. Note that the module does not
+    # sleep while USB is connected, so use the UART to save power.
+    SLEEP_MODE = 1
+
+    def __init__(self, path: str, baudrate: int = 115200, **kwargs):
+        super().__init__(path, baudrate, **kwargs)
+
+        self.gnss_fixes: deque = deque(maxlen=3600)
+        self.gnss_callback: Callable[[GNSSFix], None] = None
+
+        self.sockets: Dict[int, SIM7600GH_Socket] = {}
 
     def get_allowed_bands(self) -> List[int]:
         """Get allowed LTE bands from CNBP configuration.
@@ -35,6 +68,22 @@ class SIM7600GH(LTE_Device):
 
         return bands
 
+    def set_allowed_bands(self, bands: List[int]) -> str:
+        """Restrict LTE to the given bands, GSM/WCDMA bands are kept."""
+        self.write("AT+CNBP?")
+        response = self.read()
+        fields = [f.strip() for f in response[1].split(":")[1].split(",")]
+
+        lte_bitmask = sum(1 << (band - 1) for band in bands)
+        fields[1] = f"0x{lte_bitmask:016X}"
+
+        self.write("AT+CNBP=" + ",".join(fields))
+
+        return self.read_status("Setting bands")
+
+    def get_supported_bands(self) -> List[int]:
+        return list(SUPPORTED_BANDS)
+
     def get_active_band(self) -> int:
         """Get currently active LTE band.
 
@@ -61,6 +110,28 @@ class SIM7600GH(LTE_Device):
 
         return 0  # Unknown/not connected
 
+    def get_serving_cell(self) -> Optional[ServingCell]:
+        """Get the serving cell from AT+CPSI?, None without service.
+
+        tac is the tracking area code on LTE and the location area code on
+        GSM/WCDMA.
+        """
+        self.write("AT+CPSI?")
+        response = self.read()
+        line = find_line(response, "+CPSI:")
+        if line is None:
+            return None
+        # +CPSI: LTE,Online,310-410,0x7C11,12345678,456,EUTRAN-BAND3,...
+        fields = [f.strip() for f in line.split(":", 1)[1].split(",")]
+        if len(fields) < 5 or "-" not in fields[2]:
+            return None
+
+        mcc, mnc = fields[2].split("-")[:2]
+        try:
+            return ServingCell(fields[0], int(mcc), int(mnc), int(fields[3], 16), int(fields[4]))
+        except ValueError:
+            return None
+
     def get_version(self) -> str:
         """Get firmware version."""
         self.write("AT+CGMR")
@@ -139,3 +210,352 @@ class SIM7600GH(LTE_Device):
 
         except Exception:
             return False
+
+    def start_gnss(self) -> str:
+        """Power on the GNSS engine in standalone mode."""
+        self.write("AT+CGPS=1")
+
+        return self.read_status("Starting GNSS")
+
+    def stop_gnss(self) -> str:
+        """Power off the GNSS engine."""
+        self.write("AT+CGPS=0")
+
+        return self.read_status("Stopping GNSS")
+
+    def get_gps_fix(self) -> GNSSFix:
+        """Get the current GPS fix via AT+CGPSINFO, None without fix."""
+        self.write("AT+CGPSINFO")
+        response = self.read()
+        if response[-1] != Status.OK:
+            return None
+
+        return parse_gps_info(response[1].split(":", 1)[1])
+
+    def get_gnss_fix(self) -> GNSSFix:
+        """Get the current GNSS fix via AT+CGNSSINFO, None without fix."""
+        self.write("AT+CGNSSINFO")
+        response = self.read()
+        if response[-1] != Status.OK:
+            return None
+
+        return parse_gnss_info(response[1].split(":", 1)[1])
+
+    def handle_gnss_report(self, line: str):
+        # Runs inside whatever command is reading, so a malformed report
+        # must not make that command fail.
+        try:
+            fix = parse_gnss_info(line.split(":", 1)[1])
+        except (IndexError, ValueError) as e:
+            logger.debug(f"Dropping malformed GNSS report {line!r}: {e}")
+            return
+        if fix is None:
+            return
+
+        self.gnss_fixes.append(fix)
+        if self.gnss_callback:
+            try:
+                self.gnss_callback(fix)
+            except Exception as e:
+                logger.debug(f"GNSS callback failed: {e}")
+
+    def start_gnss_stream(
+        self,
+        interval: int = 1,
+        callback: Callable[[GNSSFix], None] = None,
+        buffer_size: int = 3600
+    ) -> str:
+        """Report a fix every interval seconds.
+
+        Fixes are parsed as the +CGNSSINFO reports arrive, kept in a ring
+        buffer of buffer_size fixes and passed to callback. Reports are picked
+        up by every command and by poll_urcs(), so the port can be used for
+        SMS at the same time. See iter_gnss_fixes().
+        """
+        self.gnss_fixes = deque(self.gnss_fixes, maxlen=buffer_size)
+        self.gnss_callback = callback
+        self.remove_urc_handler("+CGNSSINFO:", self.handle_gnss_report)
+        self.add_urc_handler("+CGNSSINFO:", self.handle_gnss_report)
+
+        self.write(f"AT+CGNSSINFO={interval}")
+
+        return self.read_status("Starting GNSS reports")
+
+    def stop_gnss_stream(self) -> str:
+        """Stop periodic GNSS reports."""
+        self.remove_urc_handler("+CGNSSINFO:", self.handle_gnss_report)
+        self.gnss_callback = None
+        self.write("AT+CGNSSINFO=0")
+
+        return self.read_status("Stopping GNSS reports")
+
+    def iter_gnss_fixes(self, timeout: float = None) -> Iterator[GNSSFix]:
+        """Yield streamed fixes as they arrive, taking them from the buffer.
+
+        Stops once no fix arrived for timeout seconds, runs forever if None.
+        """
+        last_fix = time.monotonic()
+        while True:
+            while self.gnss_fixes:
+                last_fix = time.monotonic()
+                yield self.gnss_fixes.popleft()
+
+            if timeout is not None and time.monotonic() - last_fix > timeout:
+                return
+
+            if self.poll_urcs() == 0:
+                time.sleep(0.05)
+
+    def handle_socket_report(self, line: str):
+        # +IPCLOSE: <link>,<reason> or +CIPRXGET: 1,<link>
+        fields = line.split(":")[1].split(",")
+        if line.startswith("+IPCLOSE:"):
+            socket = self.sockets.get(int(fields[0]))
+            if socket:
+                socket.handle_close_report()
+        else:
+            socket = self.sockets.get(int(fields[1]))
+            if socket:
+                socket.handle_receive_report()
+
+    def open_network(self, context_id: int = 1, timeout: float = 30) -> str:
+        """Start the internal IP stack on a PDP context.
+
+        The context is the one configured with set_context(). The AT port
+        stays usable, unlike with the RNDIS/QMI/PPP modes.
+        """
+        self.remove_urc_handler("+IPCLOSE:", self.handle_socket_report)
+        self.remove_urc_handler("+CIPRXGET: 1,", self.handle_socket_report)
+        self.add_urc_handler("+IPCLOSE:", self.handle_socket_report)
+        self.add_urc_handler("+CIPRXGET: 1,", self.handle_socket_report)
+
+        with self.lock:
+            self.write(f"AT+CSOCKSETPN={context_id}")
+            status = self.read_status("Selecting context")
+            if status != Status.OK:
+                return status
+
+            # Fetch received data manually, in hex, see SIM7600GH_Socket.
+            self.write("AT+CIPRXGET=1")
+            status = self.read_status("Manual receive mode")
+            if status != Status.OK:
+                return status
+
+            self.write("AT+NETOPEN")
+            self.expect_urc("+NETOPEN:")
+            response = self.read()
+            if "already opened" in "".join(response):
+                return Status.OK
+            if response[-1] != Status.OK:
+                return response[-1]
+
+            result = find_line(response, "+NETOPEN:")
+            if result is None:
+                result = self.wait_urc("+NETOPEN:", timeout)
+            if result is None:
+                return Status.TIMEOUT
+            if int(result.split(":")[1]) != 0:
+                return Status.ERROR
+
+        return Status.OK
+
+    def close_network(self, timeout: float = 30) -> str:
+        """Close all sockets and stop the internal IP stack."""
+        for socket in list(self.sockets.values()):
+            socket.close()
+
+        with self.lock:
+            self.write("AT+NETCLOSE")
+            self.expect_urc("+NETCLOSE:")
+            status = self.read_status("Closing network")
+            if status == Status.OK:
+                self.wait_urc("+NETCLOSE:", timeout)
+
+        self.remove_urc_handler("+IPCLOSE:", self.handle_socket_report)
+        self.remove_urc_handler("+CIPRXGET: 1,", self.handle_socket_report)
+
+        return status
+
+    def socket(self, protocol: str = "TCP", chunk_size: int = 1460) -> SIM7600GH_Socket:
+        """Create a TCP or UDP socket on a free link, see SIM7600GH_Socket."""
+        for link in range(10):
+            if link not in self.sockets:
+                socket = SIM7600GH_Socket(self, link, protocol, chunk_size)
+                self.sockets[link] = socket
+                return socket
+
+        raise OSError("No free link")
+
+    def change_directory(self, directory: str = "C:") -> str:
+        """Change the current directory of the modem filesystem."""
+        self.write(f"AT+FSCD={directory}")
+
+        return self.read_status("Changing directory")
+
+    def list_files(self, directory: str = "C:") -> List[str]:
+        """List the names of the files in a directory."""
+        with self.lock:
+            if self.change_directory(directory) != Status.OK:
+                return []
+
+            # 2: Files only
+            self.write("AT+FSLS=2")
+            response = self.read()
+            if response[-1] != Status.OK:
+                return []
+
+        # AT+FSLS=2, +FSLS: FILES:, <name>, ..., OK
+        return [line for line in response[1:-1] if not line.startswith("+FSLS:")]
+
+    def get_file_size(self, path: str) -> int:
+        """Get the size of a file like "C:/cert.pem", None if it does not exist."""
+        directory, _, name = path.rpartition("/")
+        with self.lock:
+            if self.change_directory(directory or "C:") != Status.OK:
+                return None
+
+            self.write(f"AT+FSATTRI={name}")
+            response = self.read()
+            line = find_line(response, "+FSATTRI:")
+            if response[-1] != Status.OK or line is None:
+                return None
+
+        # +FSATTRI: <size>,<date>
+        return int(line.split(":")[1].split(",")[0])
+
+    def delete_file(self, path: str) -> str:
+        """Delete a file like "C:/cert.pem"."""
+        directory, _, name = path.rpartition("/")
+        with self.lock:
+            status = self.change_directory(directory or "C:")
+            if status != Status.OK:
+                return status
+
+            self.write(f"AT+FSDEL={name}")
+
+            return self.read_status("Deleting file")
+
+    def upload_file(
+        self,
+        path: str,
+        source: Union[bytes, bytearray, memoryview, BinaryIO, str],
+        chunk_size: int = 4096,
+        progress: Callable[[int, int], None] = None,
+        verify: bool = False
+    ) -> str:
+        """Write a file like "C:/cert.pem" to the modem with AT+CFTRANRX.
+
+        source is a buffer, a binary file object or a local file name. Data
+        is streamed in chunks of chunk_size bytes, so memory use does not
+        grow with the file size, and progress(sent, total) is called after
+        each chunk. Afterwards the file size on the modem is checked; with
+        verify the file is read back and compared by CRC32.
+        """
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return self.upload_file(path, f, chunk_size, progress, verify)
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source).cast("B")
+            total = len(view)
+
+            def chunks():
+                for offset in range(0, total, chunk_size):
+                    yield view[offset:offset + chunk_size]
+        else:
+            start = source.tell()
+            total = source.seek(0, os.SEEK_END) - start
+            source.seek(start)
+            buffer = bytearray(chunk_size)
+            buffer_view = memoryview(buffer)
+
+            def chunks():
+                while True:
+                    length = source.readinto(buffer)
+                    if not length:
+                        return
+                    yield buffer_view[:length]
+
+        crc = 0
+        sent = 0
+        with self.lock:
+            self.write(f"AT+CFTRANRX=\"{path}\",{total}")
+            status = self.read_status("Upload prompt")
+            if status != Status.PROMPT:
+                return status
+
+            for chunk in chunks():
+                self.write_raw(chunk)
+                crc = zlib.crc32(chunk, crc)
+                sent += len(chunk)
+                if progress:
+                    progress(sent, total)
+
+            status = self.read_status("Uploading file")
+            if status != Status.OK:
+                return status
+
+        if sent != total or self.get_file_size(path) != total:
+            return Status.ERROR
+
+        if verify:
+            checksum = CRC32_Writer()
+            if self.download_file(path, checksum) != Status.OK:
+                return Status.ERROR
+            if checksum.crc != crc:
+                return Status.ERROR
+
+        return Status.OK
+
+    def download_file(
+        self,
+        path: str,
+        destination: Union[BinaryIO, str],
+        chunk_size: int = 2048,
+        progress: Callable[[int, int], None] = None
+    ) -> str:
+        """Read a file like "C:/cert.pem" from the modem with AT+CFTRANTX.
+
+        destination is a binary file object or a local file name. The file
+        is fetched in chunks of chunk_size bytes and progress(received,
+        total) is called after each chunk. Returns ERROR if fewer bytes than
+        the file size arrived.
+        """
+        if isinstance(destination, str):
+            with open(destination, "wb") as f:
+                return self.download_file(path, f, chunk_size, progress)
+
+        total = self.get_file_size(path)
+        if total is None:
+            return Status.ERROR
+
+        received = 0
+        with self.lock:
+            while received < total:
+                size = min(chunk_size, total - received)
+                self.write(f"AT+CFTRANTX=\"{path}\",{received},{size}")
+
+                # +CFTRANTX: DATA,<len>, the data, +CFTRANTX: 0, OK
+                header = self.read_raw_until(b"+CFTRANTX: ")
+                if not header.endswith(b"+CFTRANTX: "):
+                    return Status.TIMEOUT
+                info = self.read_raw_until(b"\r\n").decode(errors="replace").strip()
+                if not info.startswith("DATA,"):
+                    logger.debug(f"Download failed: {info}")
+                    return Status.ERROR
+
+                length = int(info.split(",")[1])
+                data = self.read_raw(length)
+                if len(data) < length:
+                    return Status.TIMEOUT
+                self.read_raw_until(b"\r\nOK\r\n")
+
+                destination.write(data)
+                received += length
+                if progress:
+                    progress(received, total)
+
+                if length == 0:
+                    break
+
+        return Status.OK if received == total else Status.ERROR
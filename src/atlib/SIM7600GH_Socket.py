@@ -0,0 +1,202 @@
+import time
+import typing
+
+from .Status import Status
+from .setup_logger import logger
+
+# Largest payload of a single AT+CIPSEND.
+MAX_SEND = 1500
+
+# Largest amount of data AT+CIPRXGET returns at once in hex mode.
+MAX_RECEIVE = 750
+
+
+def find_line(lines: typing.List[str], prefix: str) -> str:
+    """ Return the first line starting with prefix, None if there is none. """
+    for line in lines:
+        if line.startswith(prefix):
+            return line
+    return None
+
+
+class SIM7600GH_Socket:
+    """
+    A TCP or UDP socket of the SIM7600GH internal IP stack.
+
+    Create sockets with SIM7600GH.socket() after SIM7600GH.open_network().
+    Small writes are coalesced into one AT+CIPSEND of up to chunk_size
+    bytes; call flush() to send what is buffered. Received data is fetched
+    in hex mode with AT+CIPRXGET, so payloads are binary safe.
+    """
+
+    def __init__(self, device, link: int, protocol: str = "TCP", chunk_size: int = 1460):
+        self.device = device
+        self.link = link
+        self.protocol = protocol
+        self.chunk_size = min(chunk_size, MAX_SEND)
+        self.address: typing.Tuple[str, int] = None
+
+        self.send_buffer = bytearray()
+        self.receive_buffer = bytearray()
+        self.data_pending = False
+        self.closed = True
+
+    def connect(self, address: typing.Tuple[str, int], timeout: float = 30) -> str:
+        """
+        Connect to (host, port). UDP sockets are only bound, the address is
+        used as destination of all sent data. Returns status.
+        """
+        host, port = address
+        self.address = address
+        with self.device.lock:
+            if self.protocol == "UDP":
+                self.device.write(f"AT+CIPOPEN={self.link},\"UDP\",,,{port}")
+            else:
+                self.device.write(f"AT+CIPOPEN={self.link},\"TCP\",\"{host}\",{port}")
+            self.device.expect_urc("+CIPOPEN:")
+            response = self.device.read()
+            if response[-1] != Status.OK:
+                return response[-1]
+
+            # +CIPOPEN: <link>,<err> follows once the connection is up.
+            result = find_line(response, "+CIPOPEN:")
+            if result is None:
+                result = self.device.wait_urc("+CIPOPEN:", timeout)
+            if result is None:
+                return Status.TIMEOUT
+            if int(result.split(",")[1]) != 0:
+                logger.debug(f"Opening link {self.link} failed: {result}")
+                return Status.ERROR
+
+        self.closed = False
+        return Status.OK
+
+    def send(self, data: bytes) -> int:
+        """ Buffer data, sending full chunks right away. Returns its length. """
+        if self.closed:
+            raise ConnectionError(f"Link {self.link} is closed")
+
+        self.send_buffer += data
+        if len(self.send_buffer) >= self.chunk_size:
+            self.flush(full_chunks_only=True)
+        return len(data)
+
+    def sendall(self, data: bytes) -> str:
+        """ Send data and everything buffered before. Returns status. """
+        self.send(data)
+        return self.flush()
+
+    def flush(self, full_chunks_only: bool = False) -> str:
+        """ Send buffered data in chunks. Returns status. """
+        view = memoryview(self.send_buffer)
+        sent = 0
+        status = Status.OK
+        with self.device.lock:
+            while len(view) - sent > 0:
+                if full_chunks_only and len(view) - sent < self.chunk_size:
+                    break
+                status = self.send_chunk(view[sent:sent + self.chunk_size])
+                if status != Status.OK:
+                    break
+                sent += min(self.chunk_size, len(view) - sent)
+        view.release()
+
+        del self.send_buffer[:sent]
+        return status
+
+    def send_chunk(self, chunk: memoryview) -> str:
+        if self.protocol == "UDP":
+            host, port = self.address
+            self.device.write(f"AT+CIPSEND={self.link},{len(chunk)},\"{host}\",{port}")
+        else:
+            self.device.write(f"AT+CIPSEND={self.link},{len(chunk)}")
+
+        status = self.device.read_status("Send prompt")
+        if status != Status.PROMPT:
+            return status
+
+        self.device.write_raw(chunk)
+        return self.device.read_status("Sending data")
+
+    def handle_receive_report(self):
+        """ Called by the device on +CIPRXGET: 1,<link>. """
+        self.data_pending = True
+
+    def handle_close_report(self):
+        """ Called by the device on +IPCLOSE: <link>,<reason>. """
+        self.closed = True
+        self.device.sockets.pop(self.link, None)
+
+    def fetch(self) -> int:
+        """ Move data from the modem into the receive buffer. Returns bytes fetched. """
+        fetched = 0
+        with self.device.lock:
+            while True:
+                self.device.write(f"AT+CIPRXGET=3,{self.link},{MAX_RECEIVE}")
+                response = self.device.read()
+                header = find_line(response, "+CIPRXGET: 3")
+                if response[-1] != Status.OK or header is None:
+                    break
+
+                # +CIPRXGET: 3,<link>,<read_len>,<rest_len> followed by hex data.
+                fields = header.split(":")[1].split(",")
+                read_len = int(fields[2])
+                rest_len = int(fields[3])
+                if read_len > 0:
+                    data = response[response.index(header) + 1]
+                    self.receive_buffer += bytes.fromhex(data)
+                    fetched += read_len
+                if rest_len == 0:
+                    break
+
+        self.data_pending = False
+        return fetched
+
+    def recv(self, size: int, timeout: float = 0) -> bytes:
+        """
+        Receive up to size bytes, waiting up to timeout seconds for data.
+        Buffered outgoing data is flushed first. Returns b"" on timeout or
+        once the connection is closed and all data was read.
+        """
+        if self.send_buffer and not self.closed:
+            self.flush()
+
+        start_time = time.monotonic()
+        while not self.receive_buffer:
+            if not self.closed:
+                self.fetch()
+            if self.receive_buffer or self.closed:
+                break
+            if time.monotonic() - start_time >= timeout:
+                break
+            # Wait for the +CIPRXGET: 1 report before asking again.
+            while not self.data_pending and time.monotonic() - start_time < timeout:
+                if self.device.poll_urcs() == 0:
+                    time.sleep(0.05)
+
+        data = bytes(self.receive_buffer[:size])
+        del self.receive_buffer[:size]
+        return data
+
+    def close(self) -> str:
+        """ Flush and close the connection. Returns status. """
+        if self.closed:
+            self.device.sockets.pop(self.link, None)
+            return Status.OK
+
+        self.flush()
+        with self.device.lock:
+            self.device.write(f"AT+CIPCLOSE={self.link}")
+            self.device.expect_urc("+CIPCLOSE:")
+            status = self.device.read_status("Closing link")
+            if status == Status.OK:
+                self.device.wait_urc("+CIPCLOSE:")
+
+        self.handle_close_report()
+        return status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
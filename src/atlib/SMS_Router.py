@@ -0,0 +1,243 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+import typing
+
+from .SMS_Group import SMS_Group
+from .named_tuples import DeadLetter
+from .setup_logger import logger
+
+
+class Dead_Letter_Reason:
+    ERROR = "ERROR"
+    TIMEOUT = "TIMEOUT"
+    OVERFLOW = "OVERFLOW"
+
+
+class Route:
+    """ A rule and the handler jobs it has running and queued. """
+
+    def __init__(self, name: str, handler: typing.Callable[[list], None],
+                 senders: typing.Iterable[str] = None, prefix: str = None,
+                 pattern: typing.Union[str, typing.Pattern] = None,
+                 max_concurrent: int = 1, max_pending: int = 100, timeout: float = None):
+        self.name = name
+        self.handler = handler
+        self.senders = frozenset(normalize_sender(s) for s in senders) if senders else None
+        self.prefix = prefix.lower() if prefix else None
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self.running = 0
+        self.pending: deque = deque()
+
+    def matches(self, text: str) -> bool:
+        """ Content conditions, the sender is checked by the router index. """
+        if self.prefix is not None and not text.lstrip().lower().startswith(self.prefix):
+            return False
+        if self.pattern is not None and not self.pattern.search(text):
+            return False
+        return True
+
+
+def normalize_sender(sender: str) -> str:
+    return sender.replace(" ", "").replace("-", "")
+
+
+class SMS_Router:
+    """
+    Routes received messages to handlers on a bounded thread pool.
+
+    A message, as returned by GSM_Device.receive_sms(), goes to the first
+    rule in registration order whose conditions all match: sender in an
+    allowlist, text starting with a prefix (case insensitive) and text
+    matching a regex. Rules are indexed by sender and patterns compiled
+    when added, so dispatching only tests the rules that can apply.
+
+    Each rule runs at most max_concurrent handlers at once, further
+    messages wait in its queue of max_pending entries. Messages that
+    overflow the queue, whose handler raised or did not finish within the
+    rule timeout end up in dead_letters. A handler that timed out keeps its
+    pool thread until it returns, but no longer counts against its rule.
+    """
+
+    def __init__(self, workers: int = 4, dead_letters: int = 1000):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sms-router")
+        # Reentrant, as a handler finishing right away completes in submit().
+        self.lock = threading.RLock()
+
+        self.routes: typing.List[Route] = []
+        # Candidate rules in order, per allowed sender and for all others.
+        self.by_sender: typing.Dict[str, typing.List[Route]] = {}
+        self.any_sender: typing.List[Route] = []
+
+        self.dead_letters: deque = deque(maxlen=dead_letters)
+        self.matched = 0
+        self.unmatched = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.dropped = 0
+
+        self.thread: threading.Thread = None
+        self.stop_event = threading.Event()
+
+    def add_rule(self, handler: typing.Callable[[list], None], name: str = None,
+                 senders: typing.Iterable[str] = None, prefix: str = None,
+                 regex: typing.Union[str, typing.Pattern] = None,
+                 max_concurrent: int = 1, max_pending: int = 100,
+                 timeout: float = None) -> Route:
+        """
+        Call handler(message) for messages matching all given conditions.
+        A rule without conditions matches every message.
+        """
+        with self.lock:
+            name = name or getattr(handler, "__name__", f"rule{len(self.routes)}")
+            route = Route(name, handler, senders, prefix, regex, max_concurrent, max_pending, timeout)
+            self.routes.append(route)
+            if route.senders is None:
+                self.any_sender.append(route)
+                for routes in self.by_sender.values():
+                    routes.append(route)
+            else:
+                for sender in route.senders:
+                    self.by_sender.setdefault(sender, list(self.any_sender)).append(route)
+        return route
+
+    def match(self, message: list) -> typing.Optional[Route]:
+        """ First rule matching the message, None if there is none. """
+        sender, text = normalize_sender(message[0]), message[3]
+        for route in self.by_sender.get(sender, self.any_sender):
+            if route.matches(text):
+                return route
+        return None
+
+    def dispatch(self, message: list) -> bool:
+        """
+        Hand a message to the handler of its rule without waiting for it.
+        Returns False if no rule matched or the rule queue is full.
+        """
+        with self.lock:
+            route = self.match(message)
+            if route is None:
+                self.unmatched += 1
+                logger.debug(f"No rule for message from {message[0]}")
+                return False
+
+            self.matched += 1
+            if route.running < route.max_concurrent:
+                route.running += 1
+                self.start(route, message)
+            elif len(route.pending) < route.max_pending:
+                route.pending.append(message)
+            else:
+                self.dropped += 1
+                self.dead_letters.append(DeadLetter(message, route.name, Dead_Letter_Reason.OVERFLOW))
+                return False
+        return True
+
+    def start(self, route: Route, message: list):
+        """ Run a handler job, route.running is already counted. """
+        job = {"done": False}
+        future = self.pool.submit(self.call_handler, route, message, job)
+        future.add_done_callback(lambda f: self.finish(route, message, job, f))
+
+    def call_handler(self, route: Route, message: list, job: dict):
+        """ Pool job. The timeout starts with the handler, not while queued. """
+        if route.timeout is not None:
+            timer = threading.Timer(route.timeout, self.expire, args=(route, message, job))
+            timer.daemon = True
+            job["timer"] = timer
+            timer.start()
+        route.handler(message)
+
+    def finish(self, route: Route, message: list, job: dict, future):
+        if "timer" in job:
+            job["timer"].cancel()
+        error = future.exception()
+
+        with self.lock:
+            if job["done"]:
+                # Timed out before, its slot was already released.
+                return
+            job["done"] = True
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+                logger.debug(f"SMS handler {route.name} failed: {error}")
+                self.dead_letters.append(DeadLetter(message, route.name, Dead_Letter_Reason.ERROR, error))
+            self.release(route)
+
+    def expire(self, route: Route, message: list, job: dict):
+        with self.lock:
+            if job["done"]:
+                return
+            job["done"] = True
+            self.timed_out += 1
+            logger.debug(f"SMS handler {route.name} timed out after {route.timeout}s")
+            self.dead_letters.append(DeadLetter(
+                message, route.name, Dead_Letter_Reason.TIMEOUT,
+                TimeoutError(f"Handler did not finish within {route.timeout}s")
+            ))
+            self.release(route)
+
+    def release(self, route: Route):
+        """ Free a slot of route and start its next queued message. Lock held. """
+        if route.pending:
+            self.start(route, route.pending.popleft())
+        else:
+            route.running -= 1
+
+    def poll(self, device, group: str = SMS_Group.UNREAD) -> int:
+        """ Receive messages from device and dispatch them. Returns the count. """
+        with device.lock:
+            messages = device.receive_sms(group)
+        if not isinstance(messages, list):
+            logger.debug(f"Receiving messages failed: {messages}")
+            return 0
+
+        for message in messages:
+            self.dispatch(message)
+        return len(messages)
+
+    def run(self, device, interval: float = 5, group: str = SMS_Group.UNREAD):
+        """ Poll device every interval seconds until stop() is called. """
+        self.stop_event.clear()
+        while not self.stop_event.is_set():
+            try:
+                self.poll(device, group)
+            except Exception as e:
+                logger.debug(f"Polling messages failed: {e}")
+            self.stop_event.wait(interval)
+
+    def start_polling(self, device, interval: float = 5, group: str = SMS_Group.UNREAD):
+        """ Run the polling loop in a background thread. """
+        self.thread = threading.Thread(target=self.run, args=(device, interval, group), daemon=True)
+        self.thread.start()
+
+    def stop(self, wait: bool = True):
+        """ Stop polling and the pool. With wait, running handlers are awaited. """
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.pool.shutdown(wait=wait)
+
+    def get_stats(self) -> dict:
+        """ Message counts and per rule running and queued handlers. """
+        return {
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "dropped": self.dropped,
+            "dead_letters": len(self.dead_letters),
+            "rules": {
+                route.name: {"running": route.running, "pending": len(route.pending)}
+                for route in self.routes
+            },
+        }
@@ -0,0 +1,6 @@
+class SMS_Storage:
+    SIM = "SM"
+    PHONE = "ME"
+    ANY = "MT"
+    BROADCAST = "BM"
+    STATUS_REPORT = "SR"
@@ -0,0 +1,119 @@
+from collections import deque
+import json
+import re
+import typing
+
+
+class Timeout_Policy:
+    """
+    Derives read timeouts per AT command from observed response latency.
+
+    Latency is tracked as an exponentially weighted moving average and a
+    window of recent samples. The deadline is the larger of the average and
+    the configured percentile, multiplied by a safety margin and clamped to
+    floor and ceiling. Commands without enough samples use their default.
+
+    Timeouts are not latency samples. Each consecutive timeout widens the
+    deadline by margin, but never beyond the command default, and the next
+    completed command resets it.
+    """
+
+    # Commands known to take longer (or shorter) than the generic default.
+    DEFAULTS = {
+        "AT": 5,
+        "AT+COPS=?": 30,
+        "AT+CCED=": 30,
+    }
+
+    def __init__(self, default: float = 10, floor: float = 1,
+                 ceiling: float = 60, margin: float = 2,
+                 percentile: float = 0.99, alpha: float = 0.2,
+                 window: int = 100, min_samples: int = 5,
+                 defaults: typing.Dict[str, float] = None):
+        self.default = default
+        self.floor = floor
+        self.ceiling = ceiling
+        self.margin = margin
+        self.percentile = percentile
+        self.alpha = alpha
+        self.window = window
+        self.min_samples = min_samples
+        self.defaults = dict(Timeout_Policy.DEFAULTS)
+        if defaults:
+            self.defaults.update(defaults)
+
+        self.ewma: typing.Dict[str, float] = {}
+        self.samples: typing.Dict[str, deque] = {}
+        # Consecutive timeouts per command key.
+        self.timeouts: typing.Dict[str, int] = {}
+
+    def command_key(cmd: str) -> str:
+        """
+        Reduce a command line to the part identifying the command, so that
+        "AT+CMGD=1,3" and "AT+CMGD=4" share their statistics.
+        """
+        cmd = cmd.strip().upper()
+        match = re.match(r"AT([+*^&$#%]?[A-Z]*)(=\?|\?|=)?", cmd)
+        if not match:
+            return cmd
+        return "AT" + match.group(1) + (match.group(2) or "")
+
+    def record(self, key: str, latency: float):
+        """ Record the latency of a completed command. """
+        if key in self.ewma:
+            self.ewma[key] += self.alpha * (latency - self.ewma[key])
+        else:
+            self.ewma[key] = latency
+            self.samples[key] = deque(maxlen=self.window)
+        self.samples[key].append(latency)
+        self.timeouts.pop(key, None)
+
+    def record_timeout(self, key: str, timeout: float):
+        """ Record a command that timed out. See get() for the backoff. """
+        self.timeouts[key] = self.timeouts.get(key, 0) + 1
+
+    def get_percentile(self, key: str, percentile: float = None) -> float:
+        """ Get a latency percentile of a command, None without samples. """
+        if percentile is None:
+            percentile = self.percentile
+        samples = sorted(self.samples.get(key, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(percentile * len(samples)))
+        return samples[index]
+
+    def get(self, key: str) -> float:
+        """ Get the read timeout for a command key. """
+        default = self.defaults.get(key, self.default)
+        samples = self.samples.get(key, ())
+        if len(samples) < self.min_samples:
+            return default
+
+        expected = max(self.ewma[key], self.get_percentile(key))
+        timeout = min(self.ceiling, max(self.floor, expected * self.margin))
+
+        timeouts = self.timeouts.get(key, 0)
+        if timeouts:
+            timeout = min(max(timeout, default), timeout * self.margin ** timeouts)
+        return timeout
+
+    def to_dict(self) -> dict:
+        return {
+            key: {"ewma": self.ewma[key], "samples": list(self.samples[key])}
+            for key in self.ewma
+        }
+
+    def from_dict(self, data: dict):
+        for key, stats in data.items():
+            self.ewma[key] = stats["ewma"]
+            self.samples[key] = deque(stats["samples"], maxlen=self.window)
+
+    def save(self, path: str):
+        """ Persist latency statistics as JSON. """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    def load(self, path: str):
+        """ Restore latency statistics saved by save(). """
+        with open(path) as f:
+            self.from_dict(json.load(f))
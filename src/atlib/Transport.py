@@ -0,0 +1,193 @@
+import socket
+import threading
+import time
+import typing
+
+from serial import SerialException, serial_for_url
+
+from .setup_logger import logger
+
+
+def is_url(path: str) -> bool:
+    """ True for pyserial URLs like socket://host:port or rfc2217://host:port. """
+    return "://" in path
+
+
+def tune_socket(serial, keepalive_idle: int = 30):
+    """
+    Disable Nagle and enable TCP keepalive on network ports, so short
+    commands are sent right away and dead connections are detected.
+    """
+    sock = getattr(serial, "_socket", None)
+    if sock is None:
+        return
+
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Not available on all platforms.
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_idle)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, keepalive_idle // 3))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+def open_transport(path: str, baudrate: int, timeout: float = 0.5):
+    """ Open a device path or pyserial URL. Network URLs reconnect on failure. """
+    if is_url(path):
+        return Reconnecting_Serial(path, baudrate, timeout)
+    return serial_for_url(path, baudrate=baudrate, timeout=timeout)
+
+
+class Reconnecting_Serial:
+    """
+    Network serial port reopening its connection with exponential backoff.
+
+    Reconnect attempts are made from the calls using the port and never
+    block longer than one connection attempt: while waiting for the next
+    attempt, reads find no data and writes raise SerialException.
+    """
+
+    def __init__(self, url: str, baudrate: int, timeout: float = 0.5,
+                 initial_backoff: float = 0.5, max_backoff: float = 30):
+        self.url = url
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.serial = None
+        self.backoff = initial_backoff
+        self.next_attempt = 0.0
+        self.reconnects = 0
+
+        self.serial = serial_for_url(url, baudrate=baudrate, timeout=timeout)
+        tune_socket(self.serial)
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+    def disconnect(self, error: Exception):
+        logger.debug(f"Lost connection to {self.url}: {error}")
+        try:
+            self.serial.close()
+        except (SerialException, OSError):
+            pass
+        self.serial = None
+
+    def connect(self) -> bool:
+        """ Try to reconnect if the backoff elapsed. Returns True if connected. """
+        if self.serial is not None:
+            return True
+        if time.monotonic() < self.next_attempt:
+            return False
+
+        try:
+            self.serial = serial_for_url(self.url, baudrate=self.baudrate, timeout=self.timeout)
+        except (SerialException, OSError) as e:
+            self.next_attempt = time.monotonic() + self.backoff
+            logger.debug(f"Reconnecting to {self.url} failed, next attempt in {self.backoff}s: {e}")
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+            return False
+
+        tune_socket(self.serial)
+        self.backoff = self.initial_backoff
+        self.reconnects += 1
+        logger.debug(f"Reconnected to {self.url}")
+        return True
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.connect():
+            return 0
+        try:
+            waiting = self.serial.in_waiting
+            # socket:// only reports whether data is readable, not how much,
+            # which would make AT_Device.read() fetch one byte per poll.
+            if waiting and type(self.serial).__module__.endswith("protocol_socket"):
+                waiting = max(1, len(self.serial._socket.recv(65536, socket.MSG_PEEK)))
+            return waiting
+        except (SerialException, OSError) as e:
+            self.disconnect(e)
+            return 0
+
+    @property
+    def dtr(self) -> bool:
+        return self.serial.dtr if self.serial is not None else False
+
+    @dtr.setter
+    def dtr(self, active: bool):
+        if self.serial is not None:
+            self.serial.dtr = active
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.connect():
+            return b""
+        try:
+            return self.serial.read(size)
+        except (SerialException, OSError) as e:
+            self.disconnect(e)
+            return b""
+
+    def write(self, data: bytes) -> int:
+        if not self.connect():
+            raise SerialException(f"Not connected to {self.url}")
+        try:
+            return self.serial.write(data)
+        except (SerialException, OSError) as e:
+            self.disconnect(e)
+            raise
+
+    def reset_input_buffer(self):
+        if not self.connect():
+            return
+        try:
+            self.serial.reset_input_buffer()
+        except (SerialException, OSError) as e:
+            self.disconnect(e)
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+
+class Connection_Pool:
+    """
+    Keeps one open connection per device path or URL, so device objects
+    created for the same modem reuse it instead of reconnecting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections: typing.Dict[str, typing.Any] = {}
+        self.users: typing.Dict[str, int] = {}
+
+    def acquire(self, path: str, baudrate: int, timeout: float = 0.5):
+        """ Get the connection for path, opening it if needed. """
+        with self.lock:
+            if path not in self.connections:
+                self.connections[path] = open_transport(path, baudrate, timeout)
+                self.users[path] = 0
+            self.users[path] += 1
+            return self.connections[path]
+
+    def release(self, path: str):
+        """ Hand back a connection. It stays open for the next device. """
+        with self.lock:
+            if path in self.users:
+                self.users[path] = max(0, self.users[path] - 1)
+
+    def close(self, path: str):
+        with self.lock:
+            connection = self.connections.pop(path, None)
+            self.users.pop(path, None)
+        if connection is not None:
+            connection.close()
+
+    def close_all(self):
+        for path in list(self.connections):
+            self.close(path)
+
+
+# Pool used by devices opened with reuse_connection=True.
+default_pool = Connection_Pool()
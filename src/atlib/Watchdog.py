@@ -0,0 +1,213 @@
+import threading
+import time
+import typing
+
+from .GSM_Device import REGISTERED
+from .Status import Status
+from .named_tuples import ContextSpec
+from .setup_logger import logger
+
+
+class Watchdog:
+    """
+    Supervises a GSM_Device and recovers it once it stops working.
+
+    A device is unhealthy after max_failures consecutive timeouts or
+    undecodable responses, or after max_unregistered checks without network
+    registration. Recovery escalates from reset_state() to reboot() to a
+    baudrate sync and stops at the first step after which the device
+    answers. Afterwards the SIM is unlocked and operator selection, PDP
+    contexts and URC settings are restored.
+
+    Events are passed to on_event(name, info) with the names "unhealthy",
+    "recovery_step", "recovered", "restored" and "recovery_failed".
+    """
+
+    def __init__(
+        self,
+        device,
+        pin: str = None,
+        operator: str = None,
+        on_event: typing.Callable[[str, dict], None] = None,
+        max_failures: int = 3,
+        max_unregistered: int = 3,
+        probe_timeout: float = 2,
+        reboot_delay: float = 10
+    ):
+        """ operator is the short name to select, None keeps automatic selection. """
+        self.device = device
+        self.pin = pin
+        self.operator = operator
+        self.on_event = on_event
+        self.max_failures = max_failures
+        self.max_unregistered = max_unregistered
+        self.probe_timeout = probe_timeout
+        self.reboot_delay = reboot_delay
+
+        self.contexts = []
+        self.unregistered = 0
+
+        self.incidents = 0
+        self.recoveries = 0
+        self.failures = 0
+        self.down_since: float = None
+        self.total_downtime = 0.0
+        self.last_downtime = 0.0
+
+        self.thread: threading.Thread = None
+        self.stop_event = threading.Event()
+
+    def emit(self, name: str, **info):
+        logger.debug(f"Watchdog {self.device.path}: {name} {info}")
+        if self.on_event:
+            self.on_event(name, info)
+
+    def snapshot(self):
+        """ Remember PDP contexts of LTE devices to restore after recovery. """
+        if hasattr(self.device, "reconcile_contexts"):
+            with self.device.lock:
+                states = self.device.get_context_states()
+                self.contexts = [
+                    ContextSpec(context.id, context.type, context.apn, states.get(context.id, False))
+                    for context in self.device.get_contexts()
+                ]
+
+    def probe(self) -> bool:
+        """ True if the device answers AT. """
+        with self.device.lock:
+            self.device.write("AT")
+            return self.device.read(self.probe_timeout)[-1] == Status.OK
+
+    def is_registered(self) -> bool:
+        try:
+            with self.device.lock:
+                _, stat = self.device.get_network_registration()
+        except (IndexError, ValueError):
+            return False
+        return stat in REGISTERED
+
+    def check(self) -> bool:
+        """
+        Check the device and recover it if it is unhealthy.
+        Returns True if the device is healthy afterwards.
+        """
+        healthy = True
+        reason = None
+        if (self.device.consecutive_timeouts >= self.max_failures
+                or self.device.consecutive_decode_errors >= self.max_failures):
+            reason = "unresponsive"
+        elif not self.probe():
+            healthy = False
+            if self.device.consecutive_timeouts >= self.max_failures:
+                reason = "unresponsive"
+        elif self.is_registered():
+            self.unregistered = 0
+        else:
+            healthy = False
+            self.unregistered += 1
+            if self.unregistered >= self.max_unregistered:
+                reason = "unregistered"
+
+        if healthy and reason is None:
+            if self.down_since is not None:
+                self.end_downtime()
+            return True
+
+        if self.down_since is None:
+            self.down_since = time.monotonic()
+            self.incidents += 1
+        if reason is None:
+            return False
+
+        self.emit("unhealthy", reason=reason)
+        return self.recover()
+
+    def end_downtime(self):
+        self.last_downtime = time.monotonic() - self.down_since
+        self.total_downtime += self.last_downtime
+        self.down_since = None
+
+    def recover(self) -> bool:
+        """ Escalate through the recovery steps. Returns True on success. """
+        steps = [
+            ("reset_state", self.device.reset_state),
+            ("reboot", self.reboot),
+            ("sync_baudrate", lambda: self.device.sync_baudrate(retry=False)),
+        ]
+        with self.device.lock:
+            for name, step in steps:
+                self.emit("recovery_step", step=name)
+                step()
+                if self.probe():
+                    break
+            else:
+                self.failures += 1
+                self.emit("recovery_failed")
+                return False
+
+            self.restore()
+
+        self.unregistered = 0
+        self.recoveries += 1
+        if self.down_since is not None:
+            self.end_downtime()
+        self.emit("recovered", downtime=self.last_downtime)
+        return True
+
+    def reboot(self):
+        self.device.reboot()
+        time.sleep(self.reboot_delay)
+
+    def restore(self):
+        """ Restore SIM, operator, contexts and URC settings after a reboot. """
+        device = self.device
+        device.write("ATE1")
+        device.read_status("Echo")
+
+        if self.pin:
+            device.unlock_sim(self.pin)
+        if self.operator:
+            device.set_operator(self.operator)
+
+        if self.contexts:
+            device.reconcile_contexts(self.contexts)
+
+        for cmd in list(device.urc_settings.values()):
+            device.write(cmd)
+            device.read_status("Restoring URC setting")
+
+        self.emit("restored")
+
+    def run(self, interval: float = 30):
+        """ Check the device every interval seconds until stop() is called. """
+        self.stop_event.clear()
+        while not self.stop_event.wait(interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.debug(f"Watchdog check failed: {e}")
+
+    def start(self, interval: float = 30):
+        """ Run the watchdog in a background thread. """
+        self.snapshot()
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def get_stats(self) -> dict:
+        """ Incident counts and downtime in seconds. """
+        downtime = self.total_downtime
+        if self.down_since is not None:
+            downtime += time.monotonic() - self.down_since
+        return {
+            "incidents": self.incidents,
+            "recoveries": self.recoveries,
+            "failures": self.failures,
+            "down": self.down_since is not None,
+            "total_downtime": downtime,
+            "last_downtime": self.last_downtime,
+        }
@@ -5,14 +5,27 @@ AT modem library for python.
 """
 
 from atlib.AT_Device import AT_Device
+from atlib.AT_Error import AT_Error, CME_Error, CMS_Error, Timeout_Error
 from atlib.GSM_Device import GSM_Device
 from atlib.LTE_Device import LTE_Device
 
+from atlib.Band_Survey import Band_Survey
+from atlib.Capture import Capture_Serial, Replay_Serial, read_capture
+from atlib.Command_Executor import Command_Executor, Priority
+from atlib.Delivery_Tracker import Delivery_Tracker, Delivery_State
+from atlib.Fleet_Runner import Fleet_Runner
+
 from atlib.AIR780EU import AIR780EU
 from atlib.SIM7600GH import SIM7600GH
+from atlib.SIM7600GH_Socket import SIM7600GH_Socket
 
 from atlib.SMS_Group import SMS_Group
+from atlib.SMS_Router import SMS_Router, Dead_Letter_Reason
+from atlib.SMS_Storage import SMS_Storage
 from atlib.Status import Status
-from atlib.named_tuples import SignalQualityInfo, CellInfo
+from atlib.Timeout_Policy import Timeout_Policy
+from atlib.Transport import Connection_Pool, Reconnecting_Serial, default_pool
+from atlib.Watchdog import Watchdog
+from atlib.named_tuples import SignalQualityInfo, CellInfo, ServingCell, StorageInfo, GNSSFix, ContextSpec, DeadLetter
 
 __version__ = "0.5.2"
@@ -1,4 +1,7 @@
+from datetime import datetime, timezone
+
 from .Operator import Operator
+from .named_tuples import GNSSFix
 
 
 def is_valid_operator(operator: str) -> bool:
@@ -24,3 +27,71 @@ def sanitize_operator(operator: str) -> Operator:
     )
 
     return operator
+
+
+def parse_nmea_coordinate(value: str, hemisphere: str) -> float:
+    """ Convert NMEA (d)ddmm.mmmm and hemisphere to signed decimal degrees. """
+    degrees_length = value.index(".") - 2
+    degrees = int(value[:degrees_length]) + float(value[degrees_length:]) / 60
+    if hemisphere in ("S", "W"):
+        degrees = -degrees
+    return degrees
+
+
+def parse_nmea_timestamp(date: str, utc_time: str) -> float:
+    """ Convert ddmmyy and hhmmss.s to a UNIX timestamp. """
+    stamp = datetime.strptime(date + utc_time.split(".")[0], "%d%m%y%H%M%S")
+    fraction = float("0." + utc_time.split(".")[1]) if "." in utc_time else 0.0
+    return stamp.replace(tzinfo=timezone.utc).timestamp() + fraction
+
+
+def parse_gnss_info(value: str) -> GNSSFix:
+    """
+    Convert the fields of a +CGNSSINFO line to a fix, None without fix.
+
+    <mode>,<GPS-SVs>,<GLONASS-SVs>,[<GALILEO-SVs>,]<BEIDOU-SVs>,<lat>,<N/S>,
+    <log>,<E/W>,<date>,<UTC-time>,<alt>,<speed>,<course>,<PDOP>,<HDOP>,<VDOP>
+    The Galileo field depends on the firmware, so fields are counted from
+    the end.
+    """
+    fields = [f.strip() for f in value.split(",")]
+    if len(fields) < 16 or fields[-12] == "":
+        return None
+
+    satellites = sum(int(f) for f in fields[1:-12] if f != "")
+    lat, ns, lon, ew, date, utc_time, alt, speed, course, _, hdop, _ = fields[-12:]
+
+    return GNSSFix(
+        parse_nmea_timestamp(date, utc_time),
+        parse_nmea_coordinate(lat, ns),
+        parse_nmea_coordinate(lon, ew),
+        float(alt or 0),
+        float(speed or 0),
+        float(course or 0),
+        float(hdop or 0),
+        satellites,
+    )
+
+
+def parse_gps_info(value: str) -> GNSSFix:
+    """
+    Convert the fields of a +CGPSINFO line to a fix, None without fix.
+
+    <lat>,<N/S>,<log>,<E/W>,<date>,<UTC-time>,<alt>,<speed>,<course>
+    """
+    fields = [f.strip() for f in value.split(",")]
+    if len(fields) < 9 or fields[0] == "":
+        return None
+
+    lat, ns, lon, ew, date, utc_time, alt, speed, course = fields[:9]
+
+    return GNSSFix(
+        parse_nmea_timestamp(date, utc_time),
+        parse_nmea_coordinate(lat, ns),
+        parse_nmea_coordinate(lon, ew),
+        float(alt or 0),
+        float(speed or 0),
+        float(course or 0),
+        0.0,
+        0,
+    )
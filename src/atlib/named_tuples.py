@@ -22,6 +22,14 @@ class CellInfo(NamedTuple):
     pcid: int
 
 
+class ServingCell(NamedTuple):
+    system_mode: str
+    mcc: int
+    mnc: int
+    tac: int
+    cell_id: int
+
+
 class Context(NamedTuple):
     id: int
     type: str
@@ -32,3 +40,34 @@ class Context(NamedTuple):
 class Address(NamedTuple):
     id: int
     ip: str | None
+
+
+class StorageInfo(NamedTuple):
+    memory: str
+    used: int
+    total: int
+
+
+class GNSSFix(NamedTuple):
+    timestamp: float
+    latitude: float
+    longitude: float
+    altitude: float
+    speed: float
+    course: float
+    hdop: float
+    satellites: int
+
+
+class ContextSpec(NamedTuple):
+    id: int
+    type: str
+    apn: str = ""
+    active: bool = True
+
+
+class DeadLetter(NamedTuple):
+    message: list
+    rule: str
+    reason: str
+    error: Exception | None = None
@@ -0,0 +1,380 @@
+"""
+Gateway daemon sharing a fleet of modems through a JSON API.
+
+    python -m atlib.server --device modem1=/dev/ttyUSB2@SIM7600GH --http 127.0.0.1:8080
+    python -m atlib.server --device modem1=/dev/serial0 --unix /run/atlib.sock
+
+The gateway owns the devices and runs all commands through one
+Command_Executor per device. Endpoints:
+
+    GET  /devices                       Names and queue statistics
+    GET  /devices/<name>                Device details
+    GET  /devices/<name>/signal         Signal strength and quality
+    POST /devices/<name>/sms            {"number": ..., "message": ...} or a list of them
+    GET  /devices/<name>/sms/<id>       Status of a message reported as PENDING
+    GET  /devices/<name>/inbox          Received messages, ?since=<seq>&wait=<seconds>
+    GET  /devices/<name>/inbox?stream=1 Received messages as newline delimited JSON
+
+When a device queue is full, requests are rejected with 503 and the
+client should retry later. A message not sent within the command timeout
+is withdrawn and reported as TIMEOUT, so it can be retried. If it is
+already being sent, it is reported as PENDING with an id to poll, with
+status 202 for single messages.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+import atlib
+from .Command_Executor import Command_Executor, Priority
+from .GSM_Device import GSM_Device
+from .SMS_Group import SMS_Group
+from .setup_logger import logger
+
+
+class Gateway:
+    """
+    Serializes access to a set of devices and polls their inboxes.
+
+    Received messages are kept per device with increasing sequence numbers
+    so clients can resume where they left off.
+    """
+
+    def __init__(self, devices: typing.Dict[str, GSM_Device], max_pending: int = 100,
+                 inbox_interval: float = 5, inbox_size: int = 1000,
+                 command_timeout: float = 120, outbox_size: int = 1000):
+        self.devices = devices
+        self.command_timeout = command_timeout
+        self.outbox_size = outbox_size
+        self.inbox_interval = inbox_interval
+        self.executors = {
+            name: Command_Executor(device, max_pending) for name, device in devices.items()
+        }
+
+        self.inbox: typing.Dict[str, deque] = {name: deque(maxlen=inbox_size) for name in devices}
+        self.sequence = {name: 0 for name in devices}
+        self.inbox_condition = threading.Condition()
+
+        # Messages still being sent after the command timeout, by id.
+        self.outbox: typing.Dict[str, OrderedDict] = {name: OrderedDict() for name in devices}
+        self.outbox_ids = itertools.count(1)
+
+        self.running = True
+        self.pollers = [
+            threading.Thread(target=self.poll_inbox, args=(name,), daemon=True)
+            for name in devices
+        ]
+        for poller in self.pollers:
+            poller.start()
+
+    def call(self, name: str, fn: typing.Callable, *args, priority: int = Priority.DEFAULT):
+        """ Run fn on the device queue and wait for its result. """
+        future = self.executors[name].submit(fn, *args, priority=priority)
+        return future.result(self.command_timeout)
+
+    def poll_inbox(self, name: str):
+        device = self.devices[name]
+        while self.running:
+            try:
+                messages = self.call(name, device.receive_sms, SMS_Group.UNREAD,
+                                     priority=Priority.RECEIVE_SMS)
+            except OverflowError:
+                messages = []
+            except Exception as e:
+                logger.debug(f"Polling inbox of {name} failed: {e}")
+                messages = []
+
+            if isinstance(messages, list) and messages:
+                with self.inbox_condition:
+                    for sender, date, sent_time, text in messages:
+                        self.sequence[name] += 1
+                        self.inbox[name].append({
+                            "seq": self.sequence[name],
+                            "sender": sender,
+                            "date": date,
+                            "time": sent_time,
+                            "message": text,
+                        })
+                    self.inbox_condition.notify_all()
+
+            time.sleep(self.inbox_interval)
+
+    def get_messages(self, name: str, since: int = 0, wait: float = 0) -> typing.List[dict]:
+        """ Messages with a sequence number above since, waiting up to wait seconds. """
+        deadline = time.monotonic() + wait
+        with self.inbox_condition:
+            while True:
+                messages = [m for m in self.inbox[name] if m["seq"] > since]
+                remaining = deadline - time.monotonic()
+                if messages or remaining <= 0 or not self.running:
+                    return messages
+                self.inbox_condition.wait(remaining)
+
+    def send_sms(self, name: str, messages: typing.List[dict]) -> typing.List[dict]:
+        """
+        Queue all messages at once, then collect their results. Messages
+        not accepted because the queue is full are reported as rejected,
+        messages not sent in time as TIMEOUT or PENDING, see get_sms_status().
+        """
+        device = self.devices[name]
+        futures = []
+        for message in messages:
+            try:
+                futures.append(self.executors[name].submit(
+                    device.send_sms, message["number"], message["message"],
+                    priority=Priority.SEND_SMS
+                ))
+            except OverflowError:
+                futures.append(None)
+
+        deadline = time.monotonic() + self.command_timeout
+        results = []
+        for message, future in zip(messages, futures):
+            result = {"number": message["number"]}
+            if future is None:
+                result["status"] = "REJECTED"
+            else:
+                try:
+                    wait([future], max(0, deadline - time.monotonic()))
+                    if future.done():
+                        result["status"] = future.result()
+                    elif future.cancel():
+                        # Never started, so retrying does not send it twice.
+                        result["status"] = "TIMEOUT"
+                    else:
+                        result["status"] = "PENDING"
+                        result["id"] = self.track(name, future)
+                except Exception as e:
+                    result["status"] = str(e) or type(e).__name__
+            results.append(result)
+        return results
+
+    def track(self, name: str, future) -> int:
+        """ Keep a message still being sent for get_sms_status(). """
+        id = next(self.outbox_ids)
+        outbox = self.outbox[name]
+        outbox[id] = future
+        while len(outbox) > self.outbox_size:
+            outbox.popitem(last=False)
+        return id
+
+    def get_sms_status(self, name: str, id: int) -> dict:
+        """ Status of a message reported as PENDING. Raises KeyError if unknown. """
+        future = self.outbox[name][id]
+        if not future.done():
+            return {"id": id, "status": "PENDING"}
+        try:
+            status = future.result()
+        except Exception as e:
+            status = str(e) or type(e).__name__
+        return {"id": id, "status": status}
+
+    def get_info(self, name: str) -> dict:
+        device = self.devices[name]
+
+        def info():
+            return {
+                "manufacturer": device.get_manufacturer(),
+                "model": device.get_model(),
+                "imei": device.get_imei(),
+                "operator": device.get_current_operator(),
+            }
+        return self.call(name, info)
+
+    def get_signal(self, name: str) -> dict:
+        device = self.devices[name]
+
+        def signal():
+            rssi, ber = device.get_signal()
+            result = {"rssi": rssi, "ber": ber}
+            if hasattr(device, "get_signal_quality"):
+                result.update(device.get_signal_quality()._asdict())
+            return result
+        return self.call(name, signal, priority=Priority.TELEMETRY)
+
+    def get_stats(self) -> dict:
+        return {name: executor.get_stats() for name, executor in self.executors.items()}
+
+    def shutdown(self):
+        self.running = False
+        with self.inbox_condition:
+            self.inbox_condition.notify_all()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+
+class Gateway_Handler(BaseHTTPRequestHandler):
+    gateway: Gateway = None
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def send_json(self, data, code: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self) -> typing.Tuple[str, str, dict]:
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if not parts or parts[0] != "devices":
+            return None, None, query
+        name = parts[1] if len(parts) > 1 else ""
+        action = "/".join(parts[2:])
+        return name, action, query
+
+    def handle_errors(self, fn: typing.Callable):
+        try:
+            fn()
+        except OverflowError:
+            self.send_json({"error": "Device queue is full"}, 503)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json({"error": f"Bad request: {e}"}, 400)
+        except Exception as e:
+            self.send_json({"error": str(e) or type(e).__name__}, 500)
+
+    def do_GET(self):
+        self.handle_errors(self.get)
+
+    def do_POST(self):
+        self.handle_errors(self.post)
+
+    def get(self):
+        name, action, query = self.route()
+        gateway = self.gateway
+        if name is None:
+            return self.send_json({"error": "Not found"}, 404)
+        if name == "":
+            return self.send_json(gateway.get_stats())
+        if name not in gateway.devices:
+            return self.send_json({"error": f"Unknown device {name}"}, 404)
+
+        if action == "":
+            return self.send_json(gateway.get_info(name))
+        if action == "signal":
+            return self.send_json(gateway.get_signal(name))
+        if action == "inbox":
+            since = int(query.get("since", 0))
+            if query.get("stream"):
+                return self.stream_inbox(name, since)
+            wait = min(float(query.get("wait", 0)), 300)
+            return self.send_json(gateway.get_messages(name, since, wait))
+        if action.startswith("sms/"):
+            id = int(action[len("sms/"):])
+            if id not in gateway.outbox[name]:
+                return self.send_json({"error": f"Unknown message {id}"}, 404)
+            return self.send_json(gateway.get_sms_status(name, id))
+
+        self.send_json({"error": "Not found"}, 404)
+
+    def stream_inbox(self, name: str, since: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while self.gateway.running:
+                for message in self.gateway.get_messages(name, since, wait=30):
+                    self.wfile.write(json.dumps(message).encode() + b"\n")
+                    since = message["seq"]
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def post(self):
+        name, action, query = self.route()
+        if not name or name not in self.gateway.devices or action != "sms":
+            return self.send_json({"error": "Not found"}, 404)
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length))
+        batch = isinstance(body, list)
+        messages = body if batch else [body]
+        for message in messages:
+            if not isinstance(message.get("number"), str) or not isinstance(message.get("message"), str):
+                raise ValueError("number and message must be strings")
+
+        results = self.gateway.send_sms(name, messages)
+        if batch:
+            self.send_json(results)
+        else:
+            self.send_json(results[0], 202 if results[0]["status"] == "PENDING" else 200)
+
+
+class Unix_HTTP_Server(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def open_device(spec: str, pin: str = None) -> typing.Tuple[str, GSM_Device]:
+    """ Open a device from NAME=PATH[@MODEL], MODEL being an atlib class. """
+    name, path = spec.split("=", 1)
+    model = "GSM_Device"
+    if "@" in path:
+        path, model = path.rsplit("@", 1)
+
+    device = getattr(atlib, model)(path)
+    if pin:
+        device.unlock_sim(pin)
+    return name, device
+
+
+def main(argv: typing.List[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m atlib.server", description=__doc__.splitlines()[1])
+    parser.add_argument("--device", action="append", required=True, metavar="NAME=PATH[@MODEL]",
+                        help="Device to serve, e.g. modem1=/dev/ttyUSB2@SIM7600GH. Repeatable.")
+    parser.add_argument("--pin", help="SIM pin used to unlock all devices")
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument("--http", metavar="HOST:PORT", help="Serve HTTP on this address")
+    listen.add_argument("--unix", metavar="PATH", help="Serve HTTP on this Unix socket")
+    parser.add_argument("--max-pending", type=int, default=100,
+                        help="Commands queued per device before rejecting requests")
+    parser.add_argument("--inbox-interval", type=float, default=5,
+                        help="Seconds between inbox polls")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    devices = dict(open_device(spec, args.pin) for spec in args.device)
+    gateway = Gateway(devices, args.max_pending, args.inbox_interval)
+    Gateway_Handler.gateway = gateway
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = Unix_HTTP_Server(args.unix, Gateway_Handler)
+    else:
+        host, port = args.http.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), Gateway_Handler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        gateway.shutdown()
+
+
+if __name__ == "__main__":
+    main()